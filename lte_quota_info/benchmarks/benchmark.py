@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+"""Benchmarks of lte_quota_info.
+
+Runs discovery and collection against a mock conductor for fleets of
+different sizes and microbenchmarks of totals, stats files and template
+rendering. Results can be written as JSON to compare them across commits.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+import lte_quota_info  # noqa: E402
+from benchmarks.mock_conductor import Fleet, MockConductor  # noqa: E402
+from lib import routers, stats, store  # noqa: E402
+from lib.session import reset_session  # noqa: E402
+from lib.webpage import load_template  # noqa: E402
+
+# samples of a node at the end of a month with 31 days (one per minute)
+MONTH_END_SAMPLES = 31 * 24 * 60
+
+
+def measure(function, repeat=5):
+    """Return min/median of the runtime of function() in seconds."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return {
+        'min': min(durations),
+        'median': statistics.median(durations),
+        'repeat': repeat,
+    }
+
+
+def create_stats_log(count, reset_every=10000):
+    """Return samples of a node with counter resets (router restarts)."""
+    timestamp = int(time.time()) - count * 60
+    stats_log = []
+    received = sent = 0
+    for i in range(count):
+        if i and i % reset_every == 0:
+            received = sent = 0
+        received += random.randint(0, 100000)
+        sent += random.randint(0, 25000)
+        stats_log.append([timestamp + i * 60, received, sent])
+    return stats_log
+
+
+def create_config(url, stats_dir, **options):
+    """Return a config which collects from the mock conductor."""
+    config = {
+        'api_key': 'benchmark',
+        'conductor': url,
+        'default_quota': '5 GB',
+        'quotas': {},
+        'stats_dir': stats_dir,
+        'html_path': os.path.join(stats_dir, 'lte_quota_info.html'),
+        'html_template': os.path.join(BASE_DIR, 'lte_quota_info.template'),
+        'http_retries': 0,
+    }
+    config.update(options)
+    return config
+
+
+def reset_caches():
+    """Forget everything which is kept in memory between runs."""
+    reset_session()
+    routers._topology.clear()
+    stats._stores.clear()
+
+
+def bench_fleet(size, latency, repeat, options):
+    """Benchmark discovery and collection runs for a fleet."""
+    results = {}
+    stats_dir = tempfile.mkdtemp(prefix='lte_quota_info_benchmark')
+    args = argparse.Namespace(
+        workers=None, verify_totals=False, backfill=False, daemon=False,
+        timings=False)
+    try:
+        with MockConductor(Fleet(size), latency) as conductor:
+            config = create_config(conductor.url, stats_dir, **options)
+
+            def discover():
+                reset_caches()
+                routers.get_lte_nodes(config, refresh=True)
+
+            def collect():
+                reset_caches()
+                lte_quota_info.run(config, args)
+
+            results['discovery'] = measure(discover, repeat)
+            results['collection'] = measure(collect, repeat)
+            results['requests'] = conductor.requests
+    finally:
+        shutil.rmtree(stats_dir)
+    return results
+
+
+def bench_totals(count, repeat):
+    """Benchmark calculation of totals of a month-end stats log."""
+    stats_log = create_stats_log(count)
+    array = stats_log
+    if stats.numpy is not None:
+        array = stats.numpy.array(stats_log, dtype=stats.numpy.int64)
+    return {
+        'calculate_total': measure(
+            lambda: stats.calculate_total(stats_log), repeat),
+        'calculate_total_vectorized': measure(
+            lambda: stats.calculate_total_vectorized(array), repeat),
+        'replay_stats': measure(
+            lambda: stats.replay_stats(stats_log), repeat),
+    }
+
+
+def bench_files(count, repeat):
+    """Benchmark reading/writing a month-end stats file."""
+    stats_log = create_stats_log(count)
+    stats_dir = tempfile.mkdtemp(prefix='lte_quota_info_benchmark')
+    json_file = os.path.join(stats_dir, 'node.stats')
+    samples_file = os.path.join(stats_dir, 'node.samples')
+    try:
+        store.write_stats(stats_log, json_file)
+        store.write_samples(stats_log, samples_file)
+        return {
+            'write_stats': measure(
+                lambda: store.write_stats(stats_log, json_file), repeat),
+            'read_stats': measure(
+                lambda: store.read_stats(json_file), repeat),
+            'write_samples': measure(
+                lambda: store.write_samples(stats_log, samples_file), repeat),
+            'read_samples': measure(
+                lambda: store.read_samples(samples_file), repeat),
+            'append_samples': measure(
+                lambda: store.append_samples(stats_log[-1:], samples_file),
+                repeat),
+        }
+    finally:
+        shutil.rmtree(stats_dir)
+
+
+def bench_rendering(size, repeat):
+    """Benchmark rendering the template with the stats of a fleet."""
+    template = load_template(os.path.join(BASE_DIR, 'lte_quota_info.template'))
+    node_stats = [{
+        'router_name': 'router-{:05d}'.format(i),
+        'node_name': 'node1',
+        'interface_name': 'LTE1',
+        'initial_string': '5.0&nbsp;GB',
+        'used_string': '1.2&nbsp;GB',
+        'percentage': 24.0,
+        'color': 'bg-success',
+        'timestamp_unixtime': int(time.time()),
+    } for i in range(size)]
+    return measure(lambda: template.render(
+        node_stats=node_stats,
+        generated_timestamp_utc='',
+        generated_timestamp_unixtime=int(time.time()),
+        json_url=None), repeat)
+
+
+def parse_arguments():
+    """Get commandline arguments."""
+    parser = argparse.ArgumentParser(
+        description='Benchmark lte_quota_info.')
+    parser.add_argument('--fleets', default='10,100,1000,5000',
+                        help='comma-separated numbers of routers')
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='delay of every mock conductor response')
+    parser.add_argument('--samples', type=int, default=MONTH_END_SAMPLES,
+                        help='samples per node for the microbenchmarks')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='repetitions per benchmark')
+    parser.add_argument('--stats-format', default='binary',
+                        help='stats_format of the collection runs')
+    parser.add_argument('--json', help='write results to a JSON file')
+    return parser.parse_args()
+
+
+def print_result(name, result):
+    print('{:<40} min {:>9.4f} s  median {:>9.4f} s'.format(
+        name, result['min'], result['median']))
+
+
+def main():
+    args = parse_arguments()
+    random.seed(0)
+    fleets = [int(size) for size in args.fleets.split(',') if size]
+    results = {
+        'timestamp': int(time.time()),
+        'python': sys.version.split()[0],
+        'numpy': stats.numpy is not None,
+        'fleets': {},
+        'rendering': {},
+    }
+
+    results['totals'] = bench_totals(args.samples, args.repeat)
+    for name, result in results['totals'].items():
+        print_result('{} ({} samples)'.format(name, args.samples), result)
+    results['files'] = bench_files(args.samples, args.repeat)
+    for name, result in results['files'].items():
+        print_result('{} ({} samples)'.format(name, args.samples), result)
+
+    for size in fleets:
+        result = bench_rendering(size, args.repeat)
+        results['rendering'][size] = result
+        print_result('rendering ({} routers)'.format(size), result)
+
+    for size in fleets:
+        result = bench_fleet(size, args.latency, args.repeat,
+                             {'stats_format': args.stats_format})
+        results['fleets'][size] = result
+        for name in ('discovery', 'collection'):
+            print_result('{} ({} routers)'.format(name, size), result[name])
+
+    if args.json:
+        with open(args.json, 'w') as fd:
+            json.dump(results, fd, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+"""Stand-in conductor which serves a synthetic fleet of LTE routers.
+
+Serves the REST endpoints used for discovery (/api/v1/router and the
+running config of routers/nodes/device-interfaces), /api/v1/config/version
+and the GraphQL queries of lte_quota_info (topology, counters, backfill).
+Counters grow at a fixed rate per router since the start of the fleet, so
+totals are predictable. Backfill queries are answered with a point per
+minute of the requested range.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.backfill import format_time, parse_time  # noqa: E402
+
+INTERFACE_RE = re.compile(
+    r'(\w+): bytes\(router: "([^"]*)", node: "([^"]*)", port: "([^"]*)"\)')
+RANGE_RE = re.compile(
+    r' \{ timeseries\(startTime: "([^"]*)", endTime: "([^"]*)"\)')
+KPI_RE = re.compile(r'(received|sent) \{')
+FIRST_RE = re.compile(r'first: (\d+)')
+AFTER_RE = re.compile(r'after: "(\d+)"')
+
+
+class Fleet:
+    """Synthetic routers with nodes and device interfaces."""
+
+    def __init__(self, routers=100, nodes=1, lte_interfaces=1):
+        self.start = time.time()
+        self.config_version = '1'
+        self.routers = ['router-{:05d}'.format(i) for i in range(routers)]
+        self.nodes = ['node{}'.format(i + 1) for i in range(nodes)]
+        self.interfaces = [{'name': 'ge-0-0', 'type': 'ethernet'}]
+        self.interfaces += [{'name': 'LTE{}'.format(i + 1), 'type': 'lte'}
+                            for i in range(lte_interfaces)]
+
+    def get_counter(self, kpi, router, node, interface, timestamp=None):
+        """Return the counter of an interface (at timestamp)."""
+        try:
+            index = self.routers.index(router)
+        except ValueError:
+            return None
+        rate = (index % 97 + 1) * 1000
+        if kpi == 'sent':
+            rate //= 4
+        if timestamp is None:
+            timestamp = time.time()
+        return max(int((timestamp - self.start) * rate), 0)
+
+    def get_topology(self, first, after):
+        """Return a page of allRouters."""
+        start = int(after) + 1 if after is not None else 0
+        routers = self.routers[start:start + first]
+        nodes = [{
+            'name': node,
+            'assetId': 'asset-{}'.format(node),
+            'deviceInterfaces': {'nodes': self.interfaces},
+        } for node in self.nodes]
+        return {'allRouters': {
+            'pageInfo': {
+                'hasNextPage': start + first < len(self.routers),
+                'endCursor': str(start + len(routers) - 1),
+            },
+            'nodes': [{'name': router, 'nodes': {'nodes': nodes}}
+                      for router in routers],
+        }}
+
+    def get_metrics(self, query):
+        """Return counters of all aliases in a counters/backfill query."""
+        kpis = [(match.start(), match.group(1))
+                for match in KPI_RE.finditer(query)]
+        result = {}
+        for match in INTERFACE_RE.finditer(query):
+            kpi = [name for position, name in kpis
+                   if position < match.start()][-1]
+            alias, router, node, interface = match.groups()
+            timeseries = []
+            time_range = RANGE_RE.match(query, match.end())
+            if time_range:
+                start, end = (parse_time(value)
+                              for value in time_range.groups())
+                timestamps = range(start - start % 60 + 60, end + 1, 60)
+            else:
+                timestamps = [int(time.time())]
+            for timestamp in timestamps:
+                value = self.get_counter(
+                    kpi, router, node, interface, timestamp)
+                if value is not None:
+                    timeseries.append({'timestamp': format_time(timestamp),
+                                       'value': str(value)})
+            result.setdefault(kpi, {})[alias] = {'timeseries': timeseries}
+        return {'metrics': {'interface': result}}
+
+    def get_config(self, path):
+        """Return the running config below /config/running/authority."""
+        segments = [unquote(segment) for segment in path.split('/')]
+        if len(segments) == 2:
+            return [{'name': node} for node in self.nodes]
+        if len(segments) == 3:
+            return {'name': segments[2], 'asset-id': 'asset-' + segments[2]}
+        if len(segments) == 4:
+            return self.interfaces
+        return None
+
+
+class ConductorHandler(BaseHTTPRequestHandler):
+    """Answer API requests with data of the server's fleet."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def delay(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.requests += 1
+
+    def do_GET(self):
+        self.delay()
+        fleet = self.server.fleet
+        path = self.path.split('?')[0]
+        if path == '/api/v1/router':
+            self.send_json([{'name': router} for router in fleet.routers])
+        elif path == '/api/v1/config/version':
+            self.send_json({'version': fleet.config_version})
+        elif path.startswith('/api/v1/config/running/authority/router/'):
+            data = fleet.get_config(path[len(
+                '/api/v1/config/running/authority/router/'):])
+            if data is None:
+                self.send_json({'error': 'not found'}, 404)
+            else:
+                self.send_json(data)
+        else:
+            self.send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        query = json.loads(self.rfile.read(length)).get('query', '')
+        self.delay()
+        if self.path != '/api/v1/graphql':
+            self.send_json({'error': 'not found'}, 404)
+        elif 'allRouters' in query:
+            first = FIRST_RE.search(query)
+            after = AFTER_RE.search(query)
+            self.send_json({'data': self.server.fleet.get_topology(
+                int(first.group(1)) if first else 100,
+                after.group(1) if after else None)})
+        elif 'metrics' in query:
+            self.send_json({'data': self.server.fleet.get_metrics(query)})
+        else:
+            self.send_json({'errors': ['unsupported query']})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockConductor(ThreadingHTTPServer):
+    """Conductor on a local port - use as a context manager."""
+
+    daemon_threads = True
+
+    def __init__(self, fleet, latency=0, address=('127.0.0.1', 0)):
+        super().__init__(address, ConductorHandler)
+        self.fleet = fleet
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address[:2])
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+def parse_arguments():
+    """Get commandline arguments."""
+    parser = argparse.ArgumentParser(
+        description='Serve a synthetic fleet of LTE routers.')
+    parser.add_argument('--port', '-p', type=int, default=8080,
+                        help='port to listen on')
+    parser.add_argument('--routers', type=int, default=100,
+                        help='number of routers')
+    parser.add_argument('--nodes', type=int, default=1,
+                        help='number of nodes per router')
+    parser.add_argument('--lte-interfaces', type=int, default=1,
+                        help='number of LTE interfaces per node')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='delay of every response in seconds')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    fleet = Fleet(args.routers, args.nodes, args.lte_interfaces)
+    server = MockConductor(fleet, args.latency, ('127.0.0.1', args.port))
+    print('Serving {} routers on {}'.format(args.routers, server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""Handle backfilling of missed samples from conductor timeseries."""
+import bisect
+import calendar
+import time
+
+from lib.graphql import extract
+from lib.log import debug, info, warn
+from lib.stats import (
+    get_cycle, get_graphql, get_period, get_stats_store, replay_stats)
+
+
+def find_gaps(stats_log, max_gap, end=None):
+    """Return (start, end) of intervals without samples in logged stats.
+
+    With end, the interval between the last sample and end is a gap too.
+    """
+    gaps = []
+    for previous, current in zip(stats_log, stats_log[1:]):
+        if current[0] - previous[0] > max_gap:
+            gaps.append((previous[0], current[0]))
+    if end is not None and stats_log and end - stats_log[-1][0] > max_gap:
+        gaps.append((stats_log[-1][0], end))
+    return gaps
+
+
+def get_backfill_periods(node_info, timestamp):
+    """Return the previous and the current period of a node at timestamp."""
+    start = get_cycle(node_info, timestamp)[0].timestamp()
+    return [get_period(node_info, start - 1), get_period(node_info, timestamp)]
+
+
+def format_time(timestamp):
+    """Return a unix timestamp in the format of GraphQL timeseries."""
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))
+
+
+def parse_time(value):
+    """Return the unix timestamp of a timeseries point."""
+    if isinstance(value, (int, float)) or str(value).isdigit():
+        return int(value)
+    # ISO 8601 in UTC, e.g. 2020-03-01T12:00:00.000Z
+    value = value.rstrip('Z').split('.')[0]
+    return calendar.timegm(time.strptime(value, '%Y-%m-%dT%H:%M:%S'))
+
+
+def build_backfill_query(gaps):
+    """Build a single GraphQL query for the timeseries of many gaps.
+
+    gaps is a list of (node_info, start, end) - each gap is requested
+    under its own alias.
+    """
+    field = ('g%(index)d: bytes(router: "%(router)s", node: "%(node)s", '
+             'port: "%(interface)s") { timeseries('
+             'startTime: "%(start)s", endTime: "%(end)s") '
+             '{ timestamp value } }')
+    kpis = []
+    for kpi in ('received', 'sent'):
+        fields = []
+        for index, (node_info, start, end) in enumerate(gaps):
+            fields.append(field % {
+                'index': index,
+                'router': node_info['router'],
+                'node': node_info['node'],
+                'interface': node_info['interface'],
+                'start': format_time(start),
+                'end': format_time(end),
+            })
+        kpis.append('%s { %s }' % (kpi, ' '.join(fields)))
+    return '{ metrics { interface { %s } } }' % ' '.join(kpis)
+
+
+def extract_timeseries(result, kpi, alias):
+    """Return {timestamp: value} of an alias in a backfill query result."""
+    try:
+        data = result['data']['metrics']['interface'][kpi][alias]
+        timeseries = extract(data, 'timeseries')
+    except (IndexError, KeyError, TypeError):
+        return {}
+    points = {}
+    for point in timeseries or []:
+        try:
+            points[parse_time(point['timestamp'])] = int(point['value'])
+        except (KeyError, TypeError, ValueError):
+            continue
+    return points
+
+
+def merge_samples(stats_log, samples, resolution):
+    """Merge backfilled samples into logged stats - ordered by timestamp.
+
+    Backfilled samples are thinned out to one per resolution seconds -
+    also next to the logged samples.
+    """
+    merged = {entry[0]: entry for entry in stats_log}
+    timestamps = sorted(merged)
+    last = None
+    for sample in sorted(samples):
+        i = bisect.bisect_left(timestamps, sample[0])
+        neighbours = timestamps[max(i - 1, 0):i + 1]
+        if last is not None:
+            neighbours.append(last)
+        if any(abs(sample[0] - timestamp) < resolution
+               for timestamp in neighbours):
+            continue
+        merged.setdefault(sample[0], sample)
+        last = sample[0]
+    return [merged[timestamp] for timestamp in sorted(merged)]
+
+
+def backfill_stats(config, nodes):
+    """Fill gaps in the samples of the current period from the conductor.
+
+    Gaps between samples and since the last sample are filled - also
+    gaps across the start of the current period, so samples of the previous
+    period are taken into account. Backfilled samples are stored in the
+    periods of their timestamps. The
+    conductor's timeseries of all gaps are requested in chunks of
+    graphql_batch_size gaps. Checkpoints and rollups of backfilled nodes
+    are replayed from the merged samples.
+    """
+    store = get_stats_store(config)
+    interval = config.get('interval', 60)
+    max_gap = config.get('backfill_gap', 2 * interval)
+    resolution = config.get('backfill_resolution', interval)
+
+    now = int(time.time())
+    gaps = []
+    for node_info in nodes:
+        stats_log = []
+        for period in get_backfill_periods(node_info, now):
+            stats_log += store.read(node_info, period)
+        for start, end in find_gaps(stats_log, max_gap, now):
+            gaps.append((node_info, start, end))
+    if not gaps:
+        debug('No gaps to backfill.')
+        return
+    info('Backfilling', len(gaps), 'gap(s) of', len(nodes), 'node(s).')
+
+    samples = {}
+    graphql = get_graphql(config)
+    batch_size = max(config.get('graphql_batch_size', 100), 1)
+    for i in range(0, len(gaps), batch_size):
+        chunk = gaps[i:i + batch_size]
+        try:
+            result = graphql.query(build_backfill_query(chunk))
+        except Exception as e:
+            warn('Cannot backfill', len(chunk), 'gap(s) -', e)
+            continue
+        for index, (node_info, start, end) in enumerate(chunk):
+            alias = 'g{}'.format(index)
+            received = extract_timeseries(result, 'received', alias)
+            sent = extract_timeseries(result, 'sent', alias)
+            key = (node_info['router'], node_info['node'],
+                   node_info['interface'])
+            samples.setdefault(key, (node_info, []))[1].extend(
+                [timestamp, received[timestamp], sent[timestamp]]
+                for timestamp in sorted(received)
+                if timestamp in sent and start < timestamp < end)
+
+    for node_info, node_samples in samples.values():
+        if not node_samples:
+            continue
+        debug('Backfilled', len(node_samples), 'sample(s) for router:',
+              node_info['router'], 'node:', node_info['node'])
+        periods = {}
+        for sample in node_samples:
+            periods.setdefault(
+                get_period(node_info, sample[0]), []).append(sample)
+        for period, period_samples in sorted(periods.items()):
+            stats_log = merge_samples(
+                store.read(node_info, period), period_samples, resolution)
+            store.write(node_info, period, stats_log)
+            checkpoint, rollup = replay_stats(stats_log, node_info)
+            store.write_state(node_info, period, 'total', checkpoint)
+            store.write_state(node_info, period, 'rollup', rollup)
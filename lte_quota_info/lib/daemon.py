@@ -0,0 +1,89 @@
+"""Handle long-running collector mode."""
+import random
+import signal
+import threading
+import time
+
+from lib.config import read_config
+from lib.log import debug, info, warn
+from lib.session import reset_session
+
+
+def run_daemon(config_filename, config, run, flush, refresh=False,
+               backfill=False):
+    """Call run(config, refresh, backfill) on a fixed interval until SIGTERM.
+
+    Runs are scheduled at multiples of 'interval' seconds after start, so
+    the sampling interval does not drift by the runtime of a run. A random
+    delay of up to 'interval_jitter' seconds can be added to every run.
+    Gaps are only backfilled by the first successful run.
+    flush(config) is called every 'flush_interval' seconds, before a config
+    reload (SIGHUP) and on exit (SIGTERM/SIGINT) - also if the daemon
+    fails. A failing flush keeps the pending updates in memory and is
+    retried after the next run.
+    """
+    stop = threading.Event()
+    reload = threading.Event()
+
+    def handle_stop(signum, frame):
+        info('Received signal {} - stopping.'.format(signum))
+        stop.set()
+
+    def handle_reload(signum, frame):
+        info('Received SIGHUP - reloading config.')
+        reload.set()
+
+    signal.signal(signal.SIGTERM, handle_stop)
+    signal.signal(signal.SIGINT, handle_stop)
+    signal.signal(signal.SIGHUP, handle_reload)
+
+    def try_flush(config):
+        try:
+            flush(config)
+            return True
+        except (Exception, SystemExit) as e:
+            # e.g. a full disk must not stop the daemon
+            warn('Flushing stats has failed:', e)
+            return False
+
+    try:
+        next_run = time.monotonic()
+        last_flush = next_run
+        while not stop.is_set():
+            if reload.is_set():
+                reload.clear()
+                try_flush(config)
+                try:
+                    config = read_config(config_filename)
+                    reset_session()
+                    refresh = True
+                except Exception as e:
+                    warn('Cannot reload config file: {} ({})'.format(
+                        config_filename, e))
+
+            start = time.monotonic()
+            try:
+                run(config, refresh=refresh, backfill=backfill)
+                refresh = False
+                backfill = False
+            except (Exception, SystemExit) as e:
+                # a failing run (fatal() included) must not stop the daemon
+                warn('Collecting stats has failed:', e)
+            now = time.monotonic()
+            debug('Run took {:.2f} seconds'.format(now - start))
+
+            if now - last_flush >= config.get('flush_interval', 300):
+                if try_flush(config):
+                    last_flush = now
+
+            interval = config.get('interval', 60)
+            next_run += interval
+            if next_run < now:
+                skipped = int((now - next_run) / interval) + 1
+                warn('Run took longer than interval - skipping', skipped,
+                     'run(s)')
+                next_run += skipped * interval
+            jitter = random.uniform(0, config.get('interval_jitter', 0))
+            stop.wait(next_run - now + jitter)
+    finally:
+        flush(config)
@@ -1,5 +1,8 @@
 """Handle GraphQL connections."""
-import requests
+import time
+
+from lib.session import create_session, get_base_url
+from lib.timings import observe_request
 
 
 def extract(data, find_key):
@@ -17,10 +20,12 @@ def extract(data, find_key):
 class GraphQL:
     """Representation of GraphQL connection."""
 
-    def __init__(self, api_key, host='localhost'):
+    def __init__(self, api_key, host='localhost', session=None, timeout=30):
         """Constructor - loading credentials."""
         self.host = host
         self.api_key = api_key
+        self.session = session or create_session()
+        self.timeout = timeout
 
     def query(self, query):
         """Query data per GraphQL."""
@@ -28,9 +33,18 @@ class GraphQL:
             'Content-Type': 'application/json',
             'Authorization': 'Bearer {}'.format(self.api_key),
         }
-        url = 'https://{}/api/v1/graphql'.format(self.host)
-        request = requests.post(
-            url, headers=headers, json={'query': query}, verify=False)
+        url = '{}/api/v1/graphql'.format(get_base_url(self.host))
+        start = time.monotonic()
+        try:
+            request = self.session.post(
+                url, headers=headers, json={'query': query}, verify=False,
+                timeout=self.timeout)
+        except Exception:
+            observe_request('graphql', '/graphql', time.monotonic() - start,
+                            failed=True)
+            raise
+        observe_request('graphql', '/graphql', time.monotonic() - start,
+                        len(request.content), request.status_code != 200)
         if request.status_code == 200:
             return request.json()
         else:
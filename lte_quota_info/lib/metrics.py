@@ -0,0 +1,194 @@
+"""Handle Prometheus metrics of quota usage and of the collector itself."""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from lib.log import info, warn
+from lib.store import write_atomic
+from lib.timings import BUCKETS, get_phases, get_totals
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_lock = threading.Lock()
+# last exported metrics as served by the metrics server
+_exposition = ''
+
+
+def escape(value):
+    """Escape a label value."""
+    return str(value).replace('\\', '\\\\').replace(
+        '"', '\\"').replace('\n', '\\n')
+
+
+def format_metric(name, labels, value):
+    """Return a sample line in Prometheus text format."""
+    if labels:
+        label_str = ','.join(
+            '{}="{}"'.format(key, escape(labels[key])) for key in labels)
+        return '{}{{{}}} {}'.format(name, label_str, value)
+    return '{} {}'.format(name, value)
+
+
+def format_family(name, metric_type, help_text, samples):
+    """Return a metric family with its samples in Prometheus text format."""
+    lines = [
+        '# HELP {} {}'.format(name, help_text),
+        '# TYPE {} {}'.format(name, metric_type),
+    ]
+    lines.extend(format_metric(name, labels, value)
+                 for labels, value in samples)
+    return lines
+
+
+def format_histogram(name, help_text, buckets, counts, sums):
+    """Return a histogram with its samples in Prometheus text format."""
+    lines = [
+        '# HELP {} {}'.format(name, help_text),
+        '# TYPE {} histogram'.format(name),
+    ]
+    lines.extend(format_metric(name + '_bucket', labels, value)
+                 for labels, value in buckets)
+    lines.extend(format_metric(name + '_sum', labels, value)
+                 for labels, value in sums)
+    lines.extend(format_metric(name + '_count', labels, value)
+                 for labels, value in counts)
+    return lines
+
+
+def format_metrics(node_stats):
+    """Return usage of all nodes and collector metrics in text format."""
+    usage = []
+    quota = []
+    percentage = []
+    timestamp = []
+    projected = []
+    exhaustion = []
+    errors = []
+    for stats in node_stats:
+        labels = {
+            'router': stats['router_name'],
+            'node': stats['node_name'],
+            'interface': stats.get('interface_name', ''),
+        }
+        errors.append((labels, int('error' in stats)))
+        if 'error' in stats:
+            continue
+        usage.append((labels, stats['used_bytes']))
+        quota.append((labels, stats['quota_bytes']))
+        percentage.append((labels, stats['percentage']))
+        timestamp.append((labels, stats['timestamp_last_sample']))
+        if stats.get('projected_bytes') is not None:
+            projected.append((labels, stats['projected_bytes']))
+        if stats.get('timestamp_exhaustion'):
+            exhaustion.append((labels, stats['timestamp_exhaustion']))
+
+    phases = [({'phase': name}, duration)
+              for name, duration in sorted(get_phases().items())]
+    totals = get_totals()
+    requests = []
+    failures = []
+    latency = []
+    latency_sums = []
+    for (api, endpoint), request in sorted(totals['requests'].items()):
+        labels = {'api': api, 'endpoint': endpoint}
+        requests.append((labels, request['count']))
+        failures.append((labels, request['failures']))
+        latency_sums.append((labels, request['seconds']))
+        cumulative = 0
+        for bound, count in zip(BUCKETS, request['buckets']):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else bound
+            latency.append((dict(labels, le=le), cumulative))
+    io_bytes = [({'kind': kind}, size)
+                for kind, size in sorted(totals['bytes'].items())]
+
+    lines = []
+    lines += format_family(
+        'lte_quota_used_bytes', 'gauge',
+        'Bytes received and sent in the current period.', usage)
+    lines += format_family(
+        'lte_quota_limit_bytes', 'gauge',
+        'Quota of the current period in bytes.', quota)
+    lines += format_family(
+        'lte_quota_used_percent', 'gauge',
+        'Used quota in percent.', percentage)
+    lines += format_family(
+        'lte_quota_last_sample_timestamp_seconds', 'gauge',
+        'Unix time of the last sample.', timestamp)
+    lines += format_family(
+        'lte_quota_projected_bytes', 'gauge',
+        'Projected usage at the end of the current period.', projected)
+    lines += format_family(
+        'lte_quota_projected_exhaustion_timestamp_seconds', 'gauge',
+        'Unix time at which the quota is projected to be exceeded.',
+        exhaustion)
+    lines += format_family(
+        'lte_quota_collect_error', 'gauge',
+        'Whether collecting stats of a node has failed.', errors)
+    lines += format_family(
+        'lte_quota_info_phase_duration_seconds', 'gauge',
+        'Duration of the phases of the last run.', phases)
+    lines += format_family(
+        'lte_quota_info_api_requests_total', 'counter',
+        'Requests to the conductor API.', requests)
+    lines += format_family(
+        'lte_quota_info_api_failures_total', 'counter',
+        'Failed requests to the conductor API.', failures)
+    lines += format_histogram(
+        'lte_quota_info_api_request_duration_seconds',
+        'Latency of requests to the conductor API.',
+        latency, requests, latency_sums)
+    lines += format_family(
+        'lte_quota_info_bytes_total', 'counter',
+        'Bytes received from the API and read/written in stats_dir.',
+        io_bytes)
+    lines += format_family(
+        'lte_quota_info_last_run_timestamp_seconds', 'gauge',
+        'Unix time of the last run.', [({}, int(time.time()))])
+    return '\n'.join(lines) + '\n'
+
+
+def export_metrics(config, node_stats):
+    """Write metrics for the textfile collector and the metrics server."""
+    global _exposition
+    exposition = format_metrics(node_stats)
+    with _lock:
+        _exposition = exposition
+    textfile = config.get('prometheus_textfile')
+    if textfile:
+        try:
+            write_atomic(textfile, lambda fd: fd.write(exposition))
+        except OSError as e:
+            warn('Cannot write metrics file: {} ({})'.format(textfile, e))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serve the last exported metrics."""
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        with _lock:
+            body = _exposition.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(config):
+    """Serve metrics on prometheus_port in a background thread."""
+    port = config.get('prometheus_port')
+    if not port:
+        return None
+    address = config.get('prometheus_address', '')
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    info('Serving metrics on port', port)
+    return server
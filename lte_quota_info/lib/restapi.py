@@ -1,18 +1,37 @@
 """Handle Rest API connections."""
+import time
+
 from lib.log import fatal
+from lib.session import create_session, get_base_url
+from lib.timings import observe_request
 
 import requests
 urllib3 = requests.packages.urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 
+# path segments which are followed by the name of a config object
+NAMED_SEGMENTS = ('router', 'node', 'device-interface', 'network-interface')
+
+
+def get_endpoint(location):
+    """Return a location without names - e.g. /router/{name}/node."""
+    segments = location.split('/')
+    for i in range(1, len(segments)):
+        if segments[i - 1] in NAMED_SEGMENTS:
+            segments[i] = '{name}'
+    return '/'.join(segments)
+
+
 class RestApi:
     """Representation of REST connection."""
 
-    def __init__(self, api_key, host='localhost'):
+    def __init__(self, api_key, host='localhost', session=None, timeout=30):
         """Constructor - loading credentials."""
         self.api_key = api_key
         self.host = host
+        self.session = session or create_session()
+        self.timeout = timeout
 
     def get(self, location):
         """Get data per REST API."""
@@ -20,14 +39,30 @@ class RestApi:
             'Content-Type': 'application/json',
             'Authorization': 'Bearer {}'.format(self.api_key),
         }
-        url = 'https://{}/api/v1{}'.format(self.host, location)
+        url = '{}/api/v1{}'.format(get_base_url(self.host), location)
+        endpoint = get_endpoint(location)
+        start = time.monotonic()
         try:
-            response = requests.get(url, headers=headers, verify=False)
+            response = self.session.get(
+                url, headers=headers, verify=False, timeout=self.timeout)
+            observe_request('rest', endpoint, time.monotonic() - start,
+                            len(response.content), not response.ok)
             response.raise_for_status()
         except requests.exceptions.HTTPError:
-            fatal('REST API credentials are invalid.')
+            if response.status_code in (401, 403):
+                fatal('REST API credentials are invalid.')
+            # 5xx responses are only returned after all retries
+            fatal('REST API request has failed: HTTP {} for {}'.format(
+                response.status_code, location))
+        except requests.exceptions.RequestException as e:
+            observe_request('rest', endpoint, time.monotonic() - start,
+                            failed=True)
+            fatal('REST API request has failed:', e)
         return response
 
+    def get_config_version(self):
+        return self.get('/config/version').json()
+
     def get_routers(self):
         return self.get('/router').json()
 
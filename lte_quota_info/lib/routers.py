@@ -1,21 +1,116 @@
 """Handle routers, nodes, interfaces."""
-from lib.log import debug, fatal
+import json
+import os
+import time
+
+from lib.graphql import GraphQL
+from lib.log import debug, fatal, warn
 from lib.restapi import RestApi
+from lib.session import get_session, get_timeout
+from lib.stats import get_stats_dir, get_timezone
+from lib.store import write_json
 from lib.units import human_to_size
 
+INTERFACE_TYPE = 'lte'
+# last topology which has been read or written by this process
+_topology = {}
+TOPOLOGY_QUERY = '''{ allRouters(first: %(page_size)d%(after)s) {
+    pageInfo { hasNextPage endCursor }
+    nodes { name nodes { nodes { name assetId
+      deviceInterfaces { nodes { name type } } } } } } }'''
 
-def get_lte_nodes(config):
-    """Get LTE routers connected to conductor."""
-    INTERFACE_TYPE = 'lte'
-    nodes = []
-    api_key = config.get('api_key')
-    if not api_key:
-        fatal('No api_key has been specified in config file.')
-    quotas = config.get('quotas')
-    default_quota = human_to_size(config.get('default_quota', '5 GB'))
-    conductor = config.get('conductor', 'localhost')
 
-    api = RestApi(api_key, host=conductor)
+def get_topology_file(config):
+    """Return the path of the topology cache file."""
+    return os.path.join(get_stats_dir(config), 'lte_quota_info.topology')
+
+
+def read_topology(config, api):
+    """Read cached LTE interfaces - None if the cache is outdated."""
+    ttl = config.get('topology_ttl', 3600)
+    if not ttl:
+        return None
+    filename = get_topology_file(config)
+    topology = _topology.get(filename)
+    if not topology:
+        try:
+            with open(filename) as fd:
+                topology = json.load(fd)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            warn('Cannot load topology file: {}'.format(filename))
+            return None
+        _topology[filename] = topology
+
+    age = time.time() - topology.get('timestamp', 0)
+    if age > ttl:
+        debug('Topology cache has expired ({} seconds old)'.format(int(age)))
+        return None
+    if config.get('topology_check_config_version'):
+        if api.get_config_version() != topology.get('config_version'):
+            debug('Running config has changed since topology was cached')
+            return None
+    return topology.get('interfaces')
+
+
+def write_topology(config, api, interfaces):
+    """Write discovered LTE interfaces to the topology cache."""
+    if not config.get('topology_ttl', 3600):
+        return
+    topology = {
+        'timestamp': int(time.time()),
+        'interfaces': interfaces,
+    }
+    if config.get('topology_check_config_version'):
+        topology['config_version'] = api.get_config_version()
+
+    # a concurrent run must not read an incomplete file
+    filename = get_topology_file(config)
+    _topology[filename] = topology
+    try:
+        write_json(topology, filename)
+    except OSError as e:
+        warn('Cannot write topology file: {} ({})'.format(filename, e))
+
+
+def discover_lte_interfaces_graphql(graphql, page_size=100):
+    """Discover LTE interfaces of all deployed nodes per GraphQL.
+
+    The whole topology is retrieved by one query per page of routers.
+    """
+    interfaces = []
+    after = ''
+    while True:
+        result = graphql.query(TOPOLOGY_QUERY % locals())
+        if result.get('errors'):
+            raise Exception('Topology query has failed: {}'.format(
+                result['errors']))
+        all_routers = result['data']['allRouters']
+        for router in all_routers['nodes']:
+            for node in router['nodes']['nodes']:
+                if '-conductor' in node['name']:
+                    continue
+                if not node.get('assetId'):
+                    continue
+                device_interfaces = node['deviceInterfaces']['nodes']
+                for device_interface in device_interfaces:
+                    if device_interface.get('type') == INTERFACE_TYPE:
+                        interfaces.append({
+                            'router': router['name'],
+                            'node': node['name'],
+                            'interface': device_interface.get('name'),
+                        })
+        page_info = all_routers.get('pageInfo') or {}
+        if not page_info.get('hasNextPage'):
+            break
+        after = ', after: "{}"'.format(page_info['endCursor'])
+    return interfaces
+
+
+def discover_lte_interfaces(api):
+    """Discover LTE interfaces of all deployed nodes per REST API."""
+    interfaces = []
     for router in api.get_routers():
         router = router['name']
         for node in api.get_nodes(router):
@@ -27,17 +122,73 @@ def get_lte_nodes(config):
 
             for device_interface in api.get_device_interfaces(router, node):
                 if device_interface.get('type') == INTERFACE_TYPE:
-                    quota = human_to_size(quotas.get(router))
-                    if not quota:
-                        quota = default_quota
-
-                    # populate lte_node_config
-                    node_config = {
+                    interfaces.append({
                         'router': router,
                         'node': node,
                         'interface': device_interface.get('name'),
-                        'quota': quota,
-                    }
-                    debug(node_config)
-                    nodes.append(node_config)
+                    })
+    return interfaces
+
+
+def get_billing_cycle(config, router):
+    """Return start day and timezone of a router's billing cycle."""
+    cycle = {
+        'start_day': config.get('billing_start_day', 1),
+        'timezone': config.get('billing_timezone'),
+    }
+    cycle.update((config.get('billing_cycles') or {}).get(router, {}))
+    if cycle['start_day'] not in range(1, 32):
+        fatal('Invalid billing cycle start day for router {}: {}'.format(
+            router, cycle['start_day']))
+    # fail early on unknown timezones
+    get_timezone(cycle['timezone'])
+    return cycle
+
+
+def get_lte_nodes(config, refresh=False):
+    """Get LTE routers connected to conductor."""
+    nodes = []
+    api_key = config.get('api_key')
+    if not api_key:
+        fatal('No api_key has been specified in config file.')
+    quotas = config.get('quotas')
+    default_quota = human_to_size(config.get('default_quota', '5 GB'))
+    conductor = config.get('conductor', 'localhost')
+
+    api = RestApi(api_key, host=conductor, session=get_session(config),
+                  timeout=get_timeout(config))
+    interfaces = None
+    if not refresh:
+        interfaces = read_topology(config, api)
+    if interfaces is None:
+        if config.get('discovery', 'graphql') == 'graphql':
+            graphql = GraphQL(api_key, host=conductor,
+                              session=get_session(config),
+                              timeout=get_timeout(config))
+            try:
+                interfaces = discover_lte_interfaces_graphql(
+                    graphql, config.get('discovery_page_size', 100))
+            except Exception as e:
+                warn('GraphQL discovery has failed, falling back to REST:', e)
+        if interfaces is None:
+            interfaces = discover_lte_interfaces(api)
+        write_topology(config, api, interfaces)
+
+    for interface in interfaces:
+        quota = human_to_size(quotas.get(interface['router']))
+        if not quota:
+            quota = default_quota
+        billing_cycle = get_billing_cycle(config, interface['router'])
+
+        # populate lte_node_config
+        node_config = {
+            'router': interface['router'],
+            'node': interface['node'],
+            'interface': interface['interface'],
+            'quota': quota,
+            'billing_start_day': billing_cycle['start_day'],
+            'billing_timezone': billing_cycle['timezone'],
+        }
+        debug(node_config)
+        nodes.append(node_config)
     return nodes
@@ -0,0 +1,80 @@
+"""Handle pooled HTTP sessions."""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+urllib3 = requests.packages.urllib3
+
+RETRY_METHODS = frozenset(['GET', 'POST'])
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def create_retry(retries, backoff):
+    """Create retry policy for connection errors and 5xx responses."""
+    options = {
+        'total': retries,
+        'connect': retries,
+        'read': retries,
+        'status': retries,
+        'backoff_factor': backoff,
+        'status_forcelist': RETRY_STATUS_CODES,
+        # return the last response instead of raising MaxRetryError
+        'raise_on_status': False,
+    }
+    try:
+        return urllib3.util.retry.Retry(
+            allowed_methods=RETRY_METHODS, **options)
+    except TypeError:
+        # urllib3 < 1.26
+        return urllib3.util.retry.Retry(
+            method_whitelist=RETRY_METHODS, **options)
+
+
+def create_session(pool_size=10, retries=3, backoff=0.5):
+    """Create a session with a pool of keep-alive connections."""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=create_retry(retries, backoff))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session(config):
+    """Return the session which is shared by all API clients."""
+    global _session
+    with _session_lock:
+        if not _session:
+            _session = create_session(
+                pool_size=config.get(
+                    'http_pool_size', config.get('workers', 8)),
+                retries=config.get('http_retries', 3),
+                backoff=config.get('http_backoff', 0.5))
+        return _session
+
+
+def reset_session():
+    """Close the shared session - the next one is created by config."""
+    global _session
+    with _session_lock:
+        if _session:
+            _session.close()
+        _session = None
+
+
+def get_base_url(host):
+    """Return the url of a conductor - https unless host has a scheme."""
+    if '://' in host:
+        return host.rstrip('/')
+    return 'https://{}'.format(host)
+
+
+def get_timeout(config):
+    """Return (connect, read) timeout in seconds for API requests."""
+    timeout = config.get('http_timeout', 30)
+    return (min(timeout, 10), timeout)
@@ -1,91 +1,293 @@
 """Handle stats file read/write and stats retrieval."""
-import json
+import calendar
+import math
 import os
+import threading
 import time
+from datetime import datetime, timedelta
 
 from lib.log import debug, fatal, warn
 from lib.graphql import GraphQL, extract
+from lib.session import get_session, get_timeout
+from lib.store import (
+    StatsLock, cleanup_stats, get_store, read_stats, write_stats)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+except ImportError:
+    # Python < 3.9
+    ZoneInfo = None
+
+
+# time constant of the burn rate average in seconds
+RATE_TIME_CONSTANT = 86400
+# projected exhaustion times are rounded up to this resolution in seconds
+EXHAUSTION_RESOLUTION = 3600
 
 
 def get_unix_timestamp():
     return int(time.time())
 
 
-def cleanup_stats(stats_dir, days):
-    """Remove files older than n days."""
-    now = get_unix_timestamp()
-    max_age = days * 86400
-    for file in os.listdir(stats_dir):
-        path = os.path.join(stats_dir, file)
-        statinfo = os.stat(path)
-        age = now - statinfo.st_mtime
-        if age > max_age:
-            debug('Deleting old file:', path, '({} days old)'.format(
-                int(age / 86400)))
-            os.unlink(path)
+_stores = {}
+_stores_lock = threading.Lock()
 
 
-def read_stats(filename):
-    """Read stats file."""
-    try:
-        with open(filename) as fd:
-            return json.load(fd)
-    except:
-        warn('Cannot load stats file: {}'.format(filename))
-        return []
+def get_stats_dir(config):
+    """Return the directory where stats files are stored."""
+    return config.get('stats_dir', '/var/lib/128technology/lte_quota_info')
+
+
+def get_stats_store(config):
+    """Return the store of samples as configured by stats_format.
+
+    The store is shared by all nodes, so that it can batch their updates.
+    """
+    key = (get_stats_dir(config), config.get('stats_format', 'binary'))
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = get_store(*key)
+        return _stores[key]
+
+
+def lock_stats(config):
+    """Return an advisory lock of stats_dir (which is created if missing)."""
+    stats_dir = get_stats_dir(config)
+    os.makedirs(stats_dir, exist_ok=True)
+    return StatsLock(stats_dir)
+
 
+def flush_stats(config):
+    """Persist the updates of all nodes of a run."""
+    get_stats_store(config).flush()
 
-def write_stats(stats, filename):
-    """Write stats file."""
+
+def import_stats_files(config):
+    """Convert all JSON stats files in stats_dir to the binary format."""
+    store = get_stats_store(config)
+    if not hasattr(store, 'import_all'):
+        fatal('Stats files can only be imported for stats_format "binary".')
+    store.import_all()
+
+
+def get_timezone(name):
+    """Return the timezone of a name - None for local time."""
+    if not name:
+        return None
+    if ZoneInfo is None:
+        fatal('Billing cycle timezones require Python 3.9 or newer.')
     try:
-        with open(filename, 'w') as fd:
-            json.dump(stats, fd)
-    except:
-        fatal('Cannot write stats file: {}'.format(filename))
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        fatal('Unknown billing cycle timezone: {}'.format(name))
 
 
-def collect_stats(config, node_info):
-    """Collect stats and update files."""
-    router = node_info['router']
-    node = node_info['node']
-    interface = node_info['interface']
+def get_cycle_start(year, month, start_day, timezone):
+    """Return the start of a month's billing cycle.
+
+    In months which are shorter than start_day the cycle starts on their
+    last day.
+    """
+    day = min(start_day, calendar.monthrange(year, month)[1])
+    return datetime(year, month, day, tzinfo=timezone)
+
+
+def get_cycle(node_info=None, timestamp=None):
+    """Return start and end of a node's billing cycle at timestamp."""
+    node_info = node_info or {}
+    start_day = node_info.get('billing_start_day', 1)
+    timezone = get_timezone(node_info.get('billing_timezone'))
+    if timestamp is None:
+        timestamp = time.time()
+    now = datetime.fromtimestamp(timestamp, timezone)
+    year, month = now.year, now.month
+    start = get_cycle_start(year, month, start_day, timezone)
+    if now < start:
+        year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+        start = get_cycle_start(year, month, start_day, timezone)
+    year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return start, get_cycle_start(year, month, start_day, timezone)
+
+
+def get_period(node_info=None, timestamp=None):
+    """Return the period of samples which are collected at timestamp.
+
+    A period is the billing cycle of a node - the month of its start for
+    cycles which start on the 1st and its start day otherwise.
+    """
+    start = get_cycle(node_info, timestamp)[0]
+    if (node_info or {}).get('billing_start_day', 1) == 1:
+        return start.strftime('%Y-%m')
+    return start.strftime('%Y-%m-%d')
+
 
+def get_period_end(node_info=None, timestamp=None):
+    """Return the unix time at which the current period ends."""
+    end = get_cycle(node_info, timestamp)[1]
+    return int(end.timestamp())
+
+
+def prepare_stats_dir(config):
+    """Create stats_dir if missing and remove outdated files.
+
+    This is called once per run (before nodes are collected concurrently).
+    """
+    os.makedirs(get_stats_dir(config), exist_ok=True)
+    get_stats_store(config).cleanup(
+        config.get('retention_days', 60),
+        config.get('rollup_retention_days', 400))
+
+
+def get_graphql(config):
+    """Return a GraphQL client for the conductor."""
     api_key = config.get('api_key')
     if not api_key:
         fatal('No api_key has been specified in config file.')
 
-    # create stats_dir if missing
-    stats_dir = config.get(
-        'stats_dir', '/var/lib/128technology/lte_quota_info')
-    if stats_dir and not os.path.isdir(stats_dir):
-        os.mkdir(stats_dir)
-    else:
-        cleanup_stats(stats_dir, config.get('retention_days', 60))
-
     conductor = config.get('conductor', 'localhost')
-    stats = [int(time.time())]
+    return GraphQL(api_key, host=conductor, session=get_session(config),
+                   timeout=get_timeout(config))
+
+
+def get_alias(index):
+    """Return the GraphQL alias of the n-th node in a counters query."""
+    return 'n{}'.format(index)
+
+
+def build_counters_query(nodes):
+    """Build a single GraphQL query for received/sent bytes of nodes.
+
+    Every (router, node, interface) tuple is requested under its own
+    alias, so the result can be mapped back to the nodes by key.
+    """
     # Get current kpi for received/sent via GraphQL
     # (values during last 10 seconds interval)
-    query = '''{ metrics { interface { %(kpi)s {
-        bytes(router: "%(router)s", node: "%(node)s", port: "%(interface)s") {
-          timeseries(startTime: "now-10") { timestamp value } } } } } }'''
-    graphql = GraphQL(api_key, host=conductor)
+    field = ('%(alias)s: bytes(router: "%(router)s", node: "%(node)s", '
+             'port: "%(interface)s") { '
+             'timeseries(startTime: "now-10") { timestamp value } }')
+    kpis = []
     for kpi in ('received', 'sent'):
-        result = graphql.query(query % locals())
-        try:
-            value = int(extract(result, 'value'))
-        except TypeError:
-            return None
-        stats.append(value)
-
-    stats_file = os.path.join(
-        stats_dir,
-        'lte_quota_info_{}_{}_{}_{}.stats'.format(
-            router, node, interface, time.strftime('%Y-%m')))
-    stats_log = read_stats(stats_file)
-    stats_log.append(stats)
-    write_stats(stats_log, stats_file)
-    return stats_log
+        fields = []
+        for index, node_info in enumerate(nodes):
+            fields.append(field % {
+                'alias': get_alias(index),
+                'router': node_info['router'],
+                'node': node_info['node'],
+                'interface': node_info['interface'],
+            })
+        kpis.append('%s { %s }' % (kpi, ' '.join(fields)))
+    return '{ metrics { interface { %s } } }' % ' '.join(kpis)
+
+
+def extract_counter(result, kpi, alias):
+    """Return the counter value of an alias in a counters query result."""
+    try:
+        data = result['data']['metrics']['interface'][kpi][alias]
+        return int(extract(data, 'value'))
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def collect_counters(config, nodes):
+    """Query received/sent counters of multiple nodes at once.
+
+    Returns a list of [timestamp, received, sent] entries in the order
+    of nodes - or None for nodes without a result.
+    """
+    if not nodes:
+        return []
+
+    result = get_graphql(config).query(build_counters_query(nodes))
+    timestamp = get_unix_timestamp()
+    counters = []
+    for index in range(len(nodes)):
+        alias = get_alias(index)
+        received = extract_counter(result, 'received', alias)
+        sent = extract_counter(result, 'sent', alias)
+        if received is None or sent is None:
+            counters.append(None)
+        else:
+            counters.append([timestamp, received, sent])
+    return counters
+
+
+def update_stats(config, node_info, stats, verify=False):
+    """Append a [timestamp, received, sent] entry to the node's stats.
+
+    Returns the node's checkpoint, which holds the running total of the
+    period. The checkpoint and the hourly/daily rollups are replayed from
+    the samples if they do not match them (and are verified against them
+    with verify=True).
+    """
+    store = get_stats_store(config)
+    period = get_period(node_info, stats[0])
+    store.append(node_info, period, stats)
+
+    checkpoint = store.read_state(node_info, period, 'total')
+    rollup = store.read_state(node_info, period, 'rollup')
+    if checkpoint and rollup is not None and checkpoint['count'] == \
+            store.count(node_info, period) - 1:
+        previous_total = checkpoint['total']
+        update_checkpoint(checkpoint, stats)
+        update_exceeded(checkpoint, node_info.get('quota'))
+        update_rollup(rollup, stats[0], checkpoint['total'] - previous_total,
+                      get_timezone(node_info.get('billing_timezone')))
+        if verify:
+            total = calculate_total_vectorized(
+                store.read_array(node_info, period))
+            if total != checkpoint['total']:
+                warn('Checkpoint total {} does not match total {}'.format(
+                     checkpoint['total'], total),
+                     'for router:', node_info['router'],
+                     'node:', node_info['node'])
+                checkpoint, rollup = replay_stats(
+                    store.read(node_info, period), node_info)
+    else:
+        checkpoint, rollup = replay_stats(
+            store.read(node_info, period), node_info)
+    store.write_state(node_info, period, 'total', checkpoint)
+    store.write_state(node_info, period, 'rollup', rollup)
+    return checkpoint
+
+
+def get_history(config, node_info, days, timestamp=None):
+    """Return the daily usage of a node for the last n days, oldest first.
+
+    The last day is the day of timestamp in the billing timezone. The
+    usage is read from the rollups of all periods which overlap these days,
+    so it is kept after the samples have been removed.
+    """
+    if days <= 0:
+        return []
+    store = get_stats_store(config)
+    if timestamp is None:
+        timestamp = time.time()
+    timezone = get_timezone(node_info.get('billing_timezone'))
+    today = datetime.fromtimestamp(timestamp, timezone).date()
+    daily = {}
+    start = timestamp - days * 86400
+    while start <= timestamp:
+        period = get_period(node_info, start)
+        rollup = store.read_state(node_info, period, 'rollup') or {}
+        for key, usage in rollup.get('daily', {}).items():
+            daily[key] = daily.get(key, 0) + usage
+        start = get_period_end(node_info, start)
+    return [daily.get((today - timedelta(days=n)).strftime(
+                ROLLUP_FORMATS['daily']), 0)
+            for n in range(days - 1, -1, -1)]
+
+
+def collect_stats(config, node_info):
+    """Collect stats and update files."""
+    stats = collect_counters(config, [node_info])[0]
+    if not stats:
+        return None
+    return update_stats(config, node_info, stats)
 
 
 def calculate_total(stats_log):
@@ -122,3 +324,188 @@ def calculate_total(stats_log):
     total = sum(buckets)
     debug('buckets:', buckets, 'total:', total)
     return total
+
+
+def calculate_total_vectorized(stats_log):
+    """Calculate monthly totals like calculate_total() using NumPy.
+
+    stats_log may be a list of entries or an array of shape (n, 3).
+    Without NumPy the calculation falls back to calculate_total().
+    """
+    if numpy is None or not len(stats_log):
+        return calculate_total(stats_log)
+    counters = numpy.asarray(stats_log, dtype=numpy.int64)[:, 1:]
+    if (counters < 0).any():
+        # the rules below rely on counters being non-negative
+        return calculate_total(stats_log)
+
+    deltas = numpy.diff(counters, axis=0)
+    # A decreasing counter (overflow/restart) closes a bucket, so its delta
+    # is not counted. Neither is the delta after a zero value, because
+    # calculate_total() starts a new bucket at the next entry in that case.
+    counted = (deltas >= 0) & (counters[:-1] != 0)
+    total = int(deltas[counted].sum())
+    debug('total:', total)
+    return total
+
+
+def update_counter(counter, current):
+    """Apply a counter value to a running total like calculate_total()."""
+    first = counter['first']
+    last = counter['last']
+
+    # handle first entry for a new bucket
+    if not first:
+        first = current
+        last = current
+
+    # handle integer overflows/restarts
+    if current < last:
+        counter['closed'] += last - first
+        first = current
+
+    counter['first'] = first
+    counter['last'] = current
+
+
+def update_rate(checkpoint, previous_timestamp, delta):
+    """Update the burn rate of a checkpoint by the usage of an entry.
+
+    The rate is an exponentially weighted average of bytes per second,
+    which decays with RATE_TIME_CONSTANT. rate_weight corrects the bias
+    towards zero, so early in a period the rate is the plain average.
+    """
+    if previous_timestamp is None:
+        return
+    duration = checkpoint['timestamp'] - previous_timestamp
+    if duration <= 0:
+        return
+    alpha = 1 - math.exp(-duration / RATE_TIME_CONSTANT)
+    checkpoint['rate'] = (1 - alpha) * checkpoint.get('rate', 0) + \
+        alpha * delta / duration
+    checkpoint['rate_weight'] = (1 - alpha) * \
+        checkpoint.get('rate_weight', 0) + alpha
+
+
+def get_rate(checkpoint):
+    """Return the burn rate of a checkpoint in bytes per second."""
+    if not checkpoint.get('rate_weight'):
+        return None
+    return checkpoint['rate'] / checkpoint['rate_weight']
+
+
+def update_checkpoint(checkpoint, entry):
+    """Apply a [timestamp, received, sent] entry to a checkpoint."""
+    previous_timestamp = checkpoint['timestamp']
+    previous_total = checkpoint['total']
+    update_counter(checkpoint['received'], entry[1])
+    update_counter(checkpoint['sent'], entry[2])
+    checkpoint['count'] += 1
+    checkpoint['timestamp'] = entry[0]
+    checkpoint['total'] = sum(
+        counter['closed'] + counter['last'] - counter['first']
+        for counter in (checkpoint['received'], checkpoint['sent']))
+    update_rate(checkpoint, previous_timestamp,
+                checkpoint['total'] - previous_total)
+
+
+def update_exceeded(checkpoint, quota):
+    """Keep the time of the first entry whose total exceeds the quota.
+
+    checkpoint['exceeded'] is [quota, unix time] - it is removed while the
+    total is below the quota and set again if the quota has changed.
+    """
+    if quota is None or checkpoint['total'] < quota:
+        checkpoint.pop('exceeded', None)
+    elif checkpoint.get('exceeded', [None])[0] != quota:
+        checkpoint['exceeded'] = [quota, checkpoint['timestamp']]
+
+
+def get_forecast(checkpoint, quota, period_end):
+    """Project the usage of a node at the end of the period.
+
+    Returns (projected usage, unix time at which the quota is exceeded).
+    The time is None if the quota is not exceeded within the period. If
+    the quota is already exceeded, it is the time at which it has been
+    exceeded first, otherwise the projected time is rounded up to
+    EXHAUSTION_RESOLUTION, so it does not change on every run.
+    """
+    total = checkpoint['total']
+    timestamp = checkpoint['timestamp']
+    rate = get_rate(checkpoint)
+    if rate is None or timestamp is None:
+        return None, None
+    projected_total = total + int(rate * max(period_end - timestamp, 0))
+    if total >= quota:
+        exceeded = checkpoint.get('exceeded')
+        if exceeded and exceeded[0] == quota:
+            return projected_total, exceeded[1]
+        return projected_total, timestamp
+    if rate <= 0:
+        return projected_total, None
+    exhaustion = timestamp + int((quota - total) / rate)
+    if exhaustion > period_end:
+        return projected_total, None
+    exhaustion += -exhaustion % EXHAUSTION_RESOLUTION
+    return projected_total, min(exhaustion, period_end)
+
+
+def create_checkpoint(stats_log):
+    """Replay logged stats to a checkpoint.
+
+    A checkpoint holds the last counters, the first counters of the
+    current buckets and the sum of closed buckets, so that the total can
+    be updated by every new entry without replaying the whole log.
+    """
+    checkpoint = {
+        'count': 0,
+        'timestamp': None,
+        'total': 0,
+        'rate': 0,
+        'rate_weight': 0,
+        'received': {'first': None, 'last': None, 'closed': 0},
+        'sent': {'first': None, 'last': None, 'closed': 0},
+    }
+    for entry in stats_log:
+        update_checkpoint(checkpoint, entry)
+    return checkpoint
+
+
+# formats of rollup keys in the billing timezone
+ROLLUP_FORMATS = {
+    'hourly': '%Y-%m-%d %H:00',
+    'daily': '%Y-%m-%d',
+}
+
+
+def create_rollup():
+    """Return empty hourly/daily usage aggregates."""
+    return {resolution: {} for resolution in ROLLUP_FORMATS}
+
+
+def update_rollup(rollup, timestamp, delta, timezone=None):
+    """Add the usage since the previous entry to the entry's hour and day.
+
+    Hours and days are those of timezone (local time if None), so they
+    line up with the billing cycle of the rollup's period.
+    """
+    entry_time = datetime.fromtimestamp(timestamp, timezone)
+    for resolution, time_format in ROLLUP_FORMATS.items():
+        key = entry_time.strftime(time_format)
+        buckets = rollup[resolution]
+        buckets[key] = buckets.get(key, 0) + delta
+
+
+def replay_stats(stats_log, node_info=None):
+    """Replay logged stats to a checkpoint and hourly/daily rollups."""
+    node_info = node_info or {}
+    timezone = get_timezone(node_info.get('billing_timezone'))
+    checkpoint = create_checkpoint([])
+    rollup = create_rollup()
+    for entry in stats_log:
+        previous_total = checkpoint['total']
+        update_checkpoint(checkpoint, entry)
+        update_exceeded(checkpoint, node_info.get('quota'))
+        update_rollup(rollup, entry[0], checkpoint['total'] - previous_total,
+                      timezone)
+    return checkpoint, rollup
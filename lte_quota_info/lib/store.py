@@ -0,0 +1,594 @@
+"""Handle storage of stats samples.
+
+Samples are [timestamp, received, sent] entries. They are stored per
+router/node/interface and period (month) - either as a JSON list which is
+rewritten on every update, as an append-only file of fixed-width binary
+records or in a single SQLite database for all nodes.
+"""
+import fcntl
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+
+from lib.log import debug, fatal, info, warn
+from lib.timings import count_bytes
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# timestamp, received bytes, sent bytes as little endian int64
+RECORD = struct.Struct('<qqq')
+LOCK_FILE = 'lte_quota_info.lock'
+
+
+def fsync_dir(path):
+    """Make renames in a directory durable."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_atomic(filename, write, mode='w', kind=None):
+    """Write a file by write(fd) to a temporary file and rename it.
+
+    A crash or a concurrent reader never sees an incomplete file. The
+    written bytes are counted as kind (e.g. 'stats_written') if given.
+    """
+    tmp_filename = '{}.{}.{}.tmp'.format(
+        filename, os.getpid(), threading.get_ident())
+    try:
+        with open(tmp_filename, mode) as fd:
+            write(fd)
+            fd.flush()
+            os.fsync(fd.fileno())
+            if kind:
+                count_bytes(kind, os.fstat(fd.fileno()).st_size)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.unlink(tmp_filename)
+        raise
+
+
+def read_stats(filename):
+    """Read stats file."""
+    try:
+        with open(filename) as fd:
+            count_bytes('stats_read', os.fstat(fd.fileno()).st_size)
+            return json.load(fd)
+    except:
+        warn('Cannot load stats file: {}'.format(filename))
+        return []
+
+
+def write_stats(stats, filename):
+    """Write stats file."""
+    try:
+        write_json(stats, filename, kind='stats_written')
+    except:
+        fatal('Cannot write stats file: {}'.format(filename))
+
+
+def cleanup_stats(stats_dir, days, rollup_days=None):
+    """Remove files older than n days (rollups older than rollup_days)."""
+    now = int(time.time())
+    for file in os.listdir(stats_dir):
+        if file == LOCK_FILE:
+            continue
+        path = os.path.join(stats_dir, file)
+        if os.path.isdir(path):
+            continue
+        statinfo = os.stat(path)
+        age = now - statinfo.st_mtime
+        max_age = days * 86400
+        if rollup_days and file.endswith('.rollup'):
+            max_age = rollup_days * 86400
+        if age > max_age:
+            debug('Deleting old file:', path, '({} days old)'.format(
+                int(age / 86400)))
+            os.unlink(path)
+
+
+def write_json(data, filename, kind=None):
+    """Write a JSON file atomically."""
+    write_atomic(filename, lambda fd: json.dump(data, fd), kind=kind)
+
+
+def count_samples(filename):
+    """Return the number of complete records in a samples file."""
+    try:
+        return os.stat(filename).st_size // RECORD.size
+    except FileNotFoundError:
+        return 0
+
+
+def read_samples(filename):
+    """Read samples file by memory-mapping it."""
+    try:
+        with open(filename, 'rb') as fd:
+            # an incomplete trailing record is ignored
+            size = count_samples(filename) * RECORD.size
+            if not size:
+                return []
+            count_bytes('stats_read', size)
+            with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                with memoryview(data) as view:
+                    return [list(record)
+                            for record in RECORD.iter_unpack(view[:size])]
+    except FileNotFoundError:
+        return []
+
+
+def read_samples_array(filename):
+    """Read samples file into an array of shape (n, 3).
+
+    Returns a list like read_samples() if NumPy is not available.
+    """
+    if numpy is None:
+        return read_samples(filename)
+    count = count_samples(filename)
+    if not count:
+        return numpy.empty((0, 3), dtype=numpy.int64)
+    count_bytes('stats_read', count * RECORD.size)
+    return numpy.fromfile(
+        filename, dtype='<i8', count=count * 3).reshape((count, 3))
+
+
+def append_samples(samples, filename):
+    """Append records to a samples file and sync it to disk."""
+    try:
+        with open(filename, 'ab') as fd:
+            size = os.fstat(fd.fileno()).st_size
+            if size % RECORD.size:
+                # drop an incomplete record of an interrupted write
+                fd.truncate(size - size % RECORD.size)
+            data = b''.join(RECORD.pack(*sample) for sample in samples)
+            fd.write(data)
+            fd.flush()
+            count_bytes('stats_written', len(data))
+            os.fsync(fd.fileno())
+    except (OSError, struct.error) as e:
+        fatal('Cannot write samples file: {} ({})'.format(filename, e))
+
+
+def write_samples(samples, filename):
+    """Write all records of a samples file atomically."""
+    try:
+        write_atomic(filename, lambda fd: fd.write(b''.join(
+            RECORD.pack(*sample) for sample in samples)), mode='wb',
+            kind='stats_written')
+    except (OSError, struct.error) as e:
+        fatal('Cannot write samples file: {} ({})'.format(filename, e))
+
+
+class StatsLock:
+    """Advisory lock of a stats directory.
+
+    Overlapping runs wait for each other instead of updating the same
+    files concurrently.
+    """
+
+    def __init__(self, stats_dir):
+        self.filename = os.path.join(stats_dir, LOCK_FILE)
+        self.fd = None
+
+    def __enter__(self):
+        self.fd = open(self.filename, 'a')
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            info('Waiting for another run to release', self.filename)
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.fd.close()
+        self.fd = None
+
+
+class JsonStore:
+    """Store samples of a node/period in a JSON file.
+
+    Updated samples and state (running totals, rollups) are kept in
+    memory and written by flush() - every file via a temporary file,
+    fsync and rename.
+    """
+
+    suffix = '.stats'
+
+    def __init__(self, stats_dir):
+        self.stats_dir = stats_dir
+        # JSON data of samples/state files by filename
+        self.cache = {}
+        # filenames which need to be written by flush()
+        self.dirty = set()
+        self.lock = threading.Lock()
+
+    def get_path(self, node_info, period, suffix=None):
+        """Return the path of a node's file for a period."""
+        return os.path.join(
+            self.stats_dir,
+            'lte_quota_info_{}_{}_{}_{}{}'.format(
+                node_info['router'], node_info['node'],
+                node_info['interface'], period,
+                self.suffix if suffix is None else suffix))
+
+    def get_cached(self, filename):
+        """Return cached data of a file - None if it is not cached."""
+        with self.lock:
+            return self.cache.get(filename)
+
+    def set_cached(self, filename, data):
+        """Update cached data of a file, which is written by flush()."""
+        with self.lock:
+            self.cache[filename] = data
+            self.dirty.add(filename)
+
+    def load(self, filename):
+        """Read stats file - a corrupt file is moved aside, not replaced."""
+        try:
+            with open(filename) as fd:
+                count_bytes('stats_read', os.fstat(fd.fileno()).st_size)
+                return json.load(fd)
+        except FileNotFoundError:
+            return []
+        except ValueError:
+            warn('Cannot load stats file: {} (moved to {}.corrupt)'.format(
+                filename, filename))
+            os.replace(filename, filename + '.corrupt')
+            return []
+
+    def read(self, node_info, period):
+        """Return all samples of a node for a period."""
+        filename = self.get_path(node_info, period)
+        stats_log = self.get_cached(filename)
+        if stats_log is None:
+            return self.load(filename)
+        return list(stats_log)
+
+    def read_array(self, node_info, period):
+        """Return all samples of a node for a period as array if possible."""
+        return self.read(node_info, period)
+
+    def append(self, node_info, period, sample):
+        """Add a sample to a node's period."""
+        filename = self.get_path(node_info, period)
+        stats_log = self.get_cached(filename)
+        if stats_log is None:
+            stats_log = self.load(filename)
+        stats_log.append(sample)
+        self.set_cached(filename, stats_log)
+
+    def write(self, node_info, period, stats_log):
+        """Replace all samples of a node for a period."""
+        self.set_cached(self.get_path(node_info, period), list(stats_log))
+
+    def count(self, node_info, period):
+        """Return the number of samples of a node for a period."""
+        return len(self.read(node_info, period))
+
+    def read_state(self, node_info, period, kind):
+        """Return state which is kept next to the samples of a node."""
+        filename = self.get_path(node_info, period, '.' + kind)
+        state = self.get_cached(filename)
+        if state is not None:
+            return state
+        try:
+            with open(filename) as fd:
+                count_bytes('stats_read', os.fstat(fd.fileno()).st_size)
+                state = json.load(fd)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            warn('Cannot load {} file: {}'.format(kind, filename))
+            return None
+        with self.lock:
+            self.cache.setdefault(filename, state)
+        return state
+
+    def write_state(self, node_info, period, kind, state):
+        """Update state which is kept next to the samples of a node."""
+        self.set_cached(self.get_path(node_info, period, '.' + kind), state)
+
+    def cleanup(self, days, rollup_days=None):
+        """Remove samples older than n days (rollups after rollup_days)."""
+        cleanup_stats(self.stats_dir, days, rollup_days)
+
+    def write_file(self, filename, data):
+        """Write a samples or state file."""
+        write_json(data, filename, kind='stats_written')
+
+    def flush_pending(self):
+        """Write samples which are not part of the cache."""
+        pass
+
+    def flush(self):
+        """Write all updated files of a run.
+
+        Samples are written before state, so state never refers to samples
+        which have been lost. Cached data which has not been updated since
+        the last flush (e.g. of a previous month) is dropped from memory.
+        """
+        with self.lock:
+            for filename in list(self.cache):
+                if filename not in self.dirty:
+                    del self.cache[filename]
+            try:
+                samples = [filename for filename in self.dirty
+                           if filename.endswith(self.suffix)]
+                for filename in sorted(samples):
+                    self.write_file(filename, self.cache[filename])
+                self.flush_pending()
+                for filename in sorted(self.dirty.difference(samples)):
+                    write_json(self.cache[filename], filename,
+                               kind='stats_written')
+                fsync_dir(self.stats_dir)
+            except OSError as e:
+                fatal('Cannot write stats files: {}'.format(e))
+            self.dirty.clear()
+
+
+class BinaryStore(JsonStore):
+    """Store samples of a node/period in an append-only binary file.
+
+    New samples are appended by flush(). Existing JSON stats files are
+    imported on first access.
+    """
+
+    suffix = '.samples'
+
+    def __init__(self, stats_dir):
+        super().__init__(stats_dir)
+        # samples to be appended by filename
+        self.pending = {}
+
+    def get_pending(self, filename):
+        """Return samples which have not been appended yet."""
+        with self.lock:
+            return list(self.pending.get(filename, []))
+
+    def read(self, node_info, period):
+        """Return all samples of a node for a period."""
+        self.migrate(node_info, period)
+        filename = self.get_path(node_info, period)
+        stats_log = self.get_cached(filename)
+        if stats_log is None:
+            stats_log = read_samples(filename)
+        return list(stats_log) + self.get_pending(filename)
+
+    def read_array(self, node_info, period):
+        """Return all samples of a node for a period as array if possible."""
+        self.migrate(node_info, period)
+        filename = self.get_path(node_info, period)
+        if self.get_cached(filename) is None and \
+                not self.get_pending(filename):
+            return read_samples_array(filename)
+        return self.read(node_info, period)
+
+    def append(self, node_info, period, sample):
+        """Add a sample to a node's period."""
+        self.migrate(node_info, period)
+        filename = self.get_path(node_info, period)
+        with self.lock:
+            self.pending.setdefault(filename, []).append(sample)
+
+    def write(self, node_info, period, stats_log):
+        """Replace all samples of a node for a period."""
+        filename = self.get_path(node_info, period)
+        with self.lock:
+            self.pending.pop(filename, None)
+        self.set_cached(filename, list(stats_log))
+
+    def count(self, node_info, period):
+        """Return the number of samples of a node for a period."""
+        self.migrate(node_info, period)
+        filename = self.get_path(node_info, period)
+        stats_log = self.get_cached(filename)
+        if stats_log is None:
+            count = count_samples(filename)
+        else:
+            count = len(stats_log)
+        return count + len(self.get_pending(filename))
+
+    def write_file(self, filename, data):
+        """Write a samples or state file."""
+        if filename.endswith(self.suffix):
+            write_samples(data, filename)
+        else:
+            write_json(data, filename, kind='stats_written')
+
+    def flush_pending(self):
+        """Append new samples to their files.
+
+        Samples are dropped from pending once they have been appended, so a
+        failed flush can be retried without appending them twice.
+        """
+        for filename in sorted(self.pending):
+            append_samples(self.pending[filename], filename)
+            del self.pending[filename]
+        # all samples are on disk now
+        for filename in list(self.cache):
+            if filename.endswith(self.suffix):
+                del self.cache[filename]
+
+    def migrate(self, node_info, period):
+        """Import a JSON stats file unless there is a samples file."""
+        filename = self.get_path(node_info, period)
+        json_filename = self.get_path(node_info, period, JsonStore.suffix)
+        if not os.path.exists(filename) and os.path.exists(json_filename):
+            import_stats(json_filename, filename)
+
+    def import_all(self):
+        """Import all JSON stats files in stats_dir."""
+        for file in sorted(os.listdir(self.stats_dir)):
+            if not file.endswith(JsonStore.suffix):
+                continue
+            json_filename = os.path.join(self.stats_dir, file)
+            filename = json_filename[:-len(JsonStore.suffix)] + self.suffix
+            if not os.path.exists(filename):
+                import_stats(json_filename, filename)
+
+
+class SqliteStore:
+    """Store samples of all nodes in a single SQLite database.
+
+    All updates of a run are written in a single transaction, which is
+    committed by flush(). The connection is shared by all threads.
+    """
+
+    filename = 'lte_quota_info.sqlite'
+
+    def __init__(self, stats_dir):
+        self.stats_dir = stats_dir
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            os.path.join(stats_dir, self.filename),
+            timeout=60, check_same_thread=False)
+        with self.lock:
+            self.connection.executescript('''
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                CREATE TABLE IF NOT EXISTS samples (
+                    node TEXT NOT NULL,
+                    period TEXT NOT NULL,
+                    ts INTEGER NOT NULL,
+                    received INTEGER NOT NULL,
+                    sent INTEGER NOT NULL);
+                CREATE INDEX IF NOT EXISTS samples_node_ts
+                    ON samples (node, period, ts);
+                DROP INDEX IF EXISTS samples_ts;
+                CREATE TABLE IF NOT EXISTS state (
+                    node TEXT NOT NULL,
+                    period TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    updated INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (node, period, kind));
+                CREATE INDEX IF NOT EXISTS state_updated
+                    ON state (kind, updated);
+            ''')
+
+    def get_node(self, node_info):
+        """Return the key of a node in the database."""
+        return '{}/{}/{}'.format(
+            node_info['router'], node_info['node'], node_info['interface'])
+
+    def execute(self, statement, parameters=()):
+        """Execute a statement and return all rows of its result."""
+        with self.lock:
+            return self.connection.execute(statement, parameters).fetchall()
+
+    def read(self, node_info, period):
+        """Return all samples of a node for a period."""
+        return [list(row) for row in self.execute(
+            'SELECT ts, received, sent FROM samples '
+            'WHERE node = ? AND period = ? ORDER BY ts',
+            (self.get_node(node_info), period))]
+
+    def read_array(self, node_info, period):
+        """Return all samples of a node for a period as array if possible."""
+        stats_log = self.read(node_info, period)
+        if numpy is None:
+            return stats_log
+        return numpy.array(stats_log, dtype=numpy.int64).reshape((-1, 3))
+
+    def append(self, node_info, period, sample):
+        """Add a sample to a node's period."""
+        self.execute(
+            'INSERT INTO samples VALUES (?, ?, ?, ?, ?)',
+            [self.get_node(node_info), period] + list(sample))
+
+    def write(self, node_info, period, stats_log):
+        """Replace all samples of a node for a period."""
+        node = self.get_node(node_info)
+        with self.lock:
+            self.connection.execute(
+                'DELETE FROM samples WHERE node = ? AND period = ?',
+                (node, period))
+            self.connection.executemany(
+                'INSERT INTO samples VALUES (?, ?, ?, ?, ?)',
+                [[node, period] + list(entry) for entry in stats_log])
+
+    def count(self, node_info, period):
+        """Return the number of samples of a node for a period."""
+        return self.execute(
+            'SELECT COUNT(*) FROM samples WHERE node = ? AND period = ?',
+            (self.get_node(node_info), period))[0][0]
+
+    def read_state(self, node_info, period, kind):
+        """Return state which is kept next to the samples of a node."""
+        rows = self.execute(
+            'SELECT data FROM state WHERE node = ? AND period = ? '
+            'AND kind = ?', (self.get_node(node_info), period, kind))
+        if rows:
+            return json.loads(rows[0][0])
+        return None
+
+    def write_state(self, node_info, period, kind, state):
+        """Write state which is kept next to the samples of a node."""
+        self.execute(
+            'INSERT OR REPLACE INTO state VALUES (?, ?, ?, ?, ?)',
+            (self.get_node(node_info), period, kind, int(time.time()),
+             json.dumps(state)))
+
+    def cleanup(self, days, rollup_days=None):
+        """Remove periods older than n days (rollups after rollup_days).
+
+        Like the files of the other stores, the samples of a period are
+        removed as a whole once its running total (which is updated by
+        every sample) is older than n days - so the running period is never
+        truncated. Both lookups are served by indexes.
+        """
+        now = int(time.time())
+        max_age = days * 86400
+        rollup_max_age = (rollup_days or days) * 86400
+        with self.lock:
+            with self.connection:
+                expired = self.connection.execute(
+                    'SELECT node, period FROM state '
+                    'WHERE kind = ? AND updated < ?',
+                    ('total', now - max_age)).fetchall()
+                self.connection.executemany(
+                    'DELETE FROM samples WHERE node = ? AND period = ?',
+                    expired)
+                self.connection.execute(
+                    'DELETE FROM state WHERE kind != ? AND updated < ?',
+                    ('rollup', now - max_age))
+                self.connection.execute(
+                    'DELETE FROM state WHERE kind = ? AND updated < ?',
+                    ('rollup', now - rollup_max_age))
+
+    def flush(self):
+        """Commit the updates of all nodes in a single transaction."""
+        with self.lock:
+            try:
+                self.connection.commit()
+            except sqlite3.Error as e:
+                fatal('Cannot write stats database: {} ({})'.format(
+                    os.path.join(self.stats_dir, self.filename), e))
+
+
+def import_stats(json_filename, filename):
+    """Convert a JSON stats file to a samples file."""
+    debug('Importing stats file:', json_filename)
+    write_samples(read_stats(json_filename), filename)
+
+
+def get_store(stats_dir, stats_format='binary'):
+    """Return the store for a stats format."""
+    if stats_format == 'json':
+        return JsonStore(stats_dir)
+    if stats_format == 'binary':
+        return BinaryStore(stats_dir)
+    if stats_format == 'sqlite':
+        return SqliteStore(stats_dir)
+    fatal('Unknown stats_format: {}'.format(stats_format))
@@ -0,0 +1,189 @@
+"""Handle timings of runs, API requests and file I/O."""
+import copy
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from lib.log import info, warn
+
+# upper bounds of the request latency histogram in seconds
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+
+_lock = threading.Lock()
+# wall time of the phases of the current run
+_phases = {}
+# wall time of the last phases between runs (flushes of the daemon)
+_between_runs = {}
+# cumulative counters since start of the process
+_totals = {
+    # count and seconds of operations, which run in worker threads
+    'operations': {},
+    # count, failures, seconds and histogram per API endpoint
+    'requests': {},
+    # bytes received from the API and read/written from/to stats_dir
+    'bytes': {},
+}
+# counters at the start of the current run
+_baseline = copy.deepcopy(_totals)
+
+
+def begin_run():
+    """Start timings of a new run."""
+    global _baseline
+    with _lock:
+        _phases.clear()
+        _baseline = copy.deepcopy(_totals)
+
+
+@contextmanager
+def phase(name, between_runs=False):
+    """Measure the wall time of a phase of a run.
+
+    Phases between runs are kept by begin_run(), so they are reported with
+    the next run.
+    """
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        with _lock:
+            if between_runs:
+                _between_runs[name] = time.monotonic() - start
+            else:
+                _phases[name] = time.monotonic() - start
+
+
+@contextmanager
+def operation(name):
+    """Accumulate the time of an operation across threads."""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        duration = time.monotonic() - start
+        with _lock:
+            counter = _totals['operations'].setdefault(name, [0, 0.0])
+            counter[0] += 1
+            counter[1] += duration
+
+
+def observe_request(api, endpoint, duration, size=0, failed=False):
+    """Count a request to the conductor's API and its latency."""
+    with _lock:
+        request = _totals['requests'].setdefault((api, endpoint), {
+            'count': 0,
+            'failures': 0,
+            'seconds': 0.0,
+            'buckets': [0] * len(BUCKETS),
+        })
+        request['count'] += 1
+        request['failures'] += int(failed)
+        request['seconds'] += duration
+        for i, bound in enumerate(BUCKETS):
+            if duration <= bound:
+                request['buckets'][i] += 1
+                break
+        _totals['bytes']['api_received'] = \
+            _totals['bytes'].get('api_received', 0) + size
+
+
+def count_bytes(kind, size):
+    """Count bytes read or written from/to stats_dir."""
+    with _lock:
+        _totals['bytes'][kind] = _totals['bytes'].get(kind, 0) + size
+
+
+def get_phases():
+    """Return the wall time of the phases of the current run."""
+    with _lock:
+        return dict(_between_runs, **_phases)
+
+
+def get_totals():
+    """Return the counters since start of the process."""
+    with _lock:
+        return copy.deepcopy(_totals)
+
+
+def get_timings():
+    """Return the timings of the current run as a JSON-compatible dict."""
+    with _lock:
+        totals = copy.deepcopy(_totals)
+        baseline = copy.deepcopy(_baseline)
+        phases = dict(_between_runs, **_phases)
+
+    operations = {}
+    for name, (count, seconds) in totals['operations'].items():
+        count_before, seconds_before = baseline['operations'].get(
+            name, (0, 0.0))
+        if count > count_before:
+            operations[name] = {
+                'count': count - count_before,
+                'seconds': seconds - seconds_before,
+            }
+
+    requests = []
+    for (api, endpoint), request in sorted(totals['requests'].items()):
+        before = baseline['requests'].get((api, endpoint))
+        if before:
+            request = {
+                'count': request['count'] - before['count'],
+                'failures': request['failures'] - before['failures'],
+                'seconds': request['seconds'] - before['seconds'],
+                'buckets': [a - b for a, b in zip(
+                    request['buckets'], before['buckets'])],
+            }
+        if request['count']:
+            requests.append(dict(request, api=api, endpoint=endpoint))
+
+    return {
+        'timestamp': int(time.time()),
+        'phases': phases,
+        'operations': operations,
+        'requests': requests,
+        'bytes': {kind: size - baseline['bytes'].get(kind, 0)
+                  for kind, size in totals['bytes'].items()},
+    }
+
+
+def get_percentile(buckets, percentile):
+    """Return the upper bound of the bucket containing a percentile."""
+    rank = sum(buckets) * percentile / 100
+    seen = 0
+    for bound, count in zip(BUCKETS, buckets):
+        seen += count
+        if count and seen >= rank:
+            return bound
+    return 0
+
+
+def print_timings(timings):
+    """Log a summary of the timings of a run."""
+    info('Phases:')
+    for name, seconds in timings['phases'].items():
+        info('  {:<24} {:>9.3f} s'.format(name, seconds))
+    info('Operations (summed across workers):')
+    for name, operation in sorted(timings['operations'].items()):
+        info('  {:<24} {:>9.3f} s {:>7} calls'.format(
+            name, operation['seconds'], operation['count']))
+    info('API requests:')
+    for request in timings['requests']:
+        info('  {:<24} {:>9.3f} s {:>7} calls {:>4} failed '
+             'avg {:.3f} s p95 <= {} s'.format(
+                 '{} {}'.format(request['api'], request['endpoint']),
+                 request['seconds'], request['count'], request['failures'],
+                 request['seconds'] / request['count'],
+                 get_percentile(request['buckets'], 95)))
+    info('Bytes:')
+    for kind, size in sorted(timings['bytes'].items()):
+        info('  {:<24} {:>9}'.format(kind, size))
+
+
+def write_timings(filename, timings):
+    """Append the timings of a run as a JSON line."""
+    try:
+        with open(filename, 'a') as fd:
+            fd.write(json.dumps(timings, sort_keys=True) + '\n')
+    except OSError as e:
+        warn('Cannot write timings file: {} ({})'.format(filename, e))
@@ -1,30 +1,159 @@
 """Handle webpage generation."""
+import hashlib
+import json
 import os
 import sys
 import time
-from jinja2 import Template
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+from lib.log import debug
+from lib.stats import get_stats_dir
+from lib.store import write_atomic
+
+# jinja2 environments by template directory
+_environments = {}
+# fields which change on every run without changing the rendered stats
+VOLATILE_FIELDS = ('timestamp_unixtime', 'timestamp_last_sample')
+# columns of nodes in the json document
+JSON_FIELDS = (
+    'router_name',
+    'node_name',
+    'used_string',
+    'initial_string',
+    'percentage',
+    'color',
+    'timestamp_unixtime',
+    'projected_string',
+    'timestamp_exhaustion',
+    'history',
+    'error',
+)
+
+
+def load_template(template_path, cache_dir=None):
+    """Return the compiled template.
+
+    Templates are compiled once per process and their bytecode is cached
+    in cache_dir across processes. A changed template is compiled again.
+    """
+    template_dir, template_name = os.path.split(template_path)
+    key = (template_dir, cache_dir)
+    if key not in _environments:
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(cache_dir)
+        else:
+            bytecode_cache = FileSystemBytecodeCache()
+        _environments[key] = Environment(
+            loader=FileSystemLoader(template_dir),
+            bytecode_cache=bytecode_cache,
+            auto_reload=True)
+    return _environments[key].get_template(template_name)
+
+
+def get_content_hash(template_path, node_stats, json_url=None):
+    """Return a hash of the template and the stats without volatile fields.
+
+    node_stats is None for html documents which load the stats from the
+    JSON document. Raw byte counts are rendered by their *_string fields,
+    so they are not part of the hash either.
+    """
+    content = {
+        'template_mtime': os.stat(template_path).st_mtime,
+        'json_url': json_url,
+        'node_stats': [
+            {key: value for key, value in stats.items()
+             if key not in VOLATILE_FIELDS and not key.endswith('_bytes')}
+            for stats in node_stats or []],
+    }
+    return hashlib.sha256(
+        json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+def get_hash_file(config):
+    """Return the path of the file with the last written content hash."""
+    return os.path.join(get_stats_dir(config), 'lte_quota_info.hash')
+
+
+def read_content_hash(config):
+    """Return the content hash of the last written document."""
+    try:
+        with open(get_hash_file(config)) as fd:
+            return fd.read()
+    except FileNotFoundError:
+        return None
+
+
+def get_json_document(node_stats, generated_timestamp_unixtime):
+    """Return the json document - a compact table of all nodes."""
+    nodes = []
+    for stats in node_stats:
+        row = [stats.get(field) for field in JSON_FIELDS]
+        if stats.get('percentage') is not None:
+            row[JSON_FIELDS.index('percentage')] = round(
+                stats['percentage'], 2)
+        nodes.append(row)
+    return json.dumps({
+        'generated_timestamp_unixtime': generated_timestamp_unixtime,
+        'fields': JSON_FIELDS,
+        'nodes': nodes,
+    }, separators=(',', ':'))
+
+
+def write_document(path, content):
+    """Write a document atomically if the directory is writable."""
+    try:
+        write_atomic(path, lambda fd: fd.write(content))
+    except PermissionError:
+        # only the document itself may be writable (see README)
+        with open(path, 'w') as fd:
+            fd.write(content)
 
 
 def create_html_document(config, node_stats):
-    """Create html document based on stats."""
+    """Create html document based on stats.
+
+    With json_path the stats are written to the JSON document on every
+    run and the html document only depends on the template. Otherwise the
+    html document is only written if the stats have changed since it has
+    been written last.
+    """
     try:
         template_path = config.get(
             'html_template', 'lte_quota_info.template')
         html_path = config.get(
             'html_path', '/var/www/128technology/lte_quota_info.html')
+        json_path = config.get('json_path')
+        json_url = None
+        if json_path:
+            json_url = config.get('json_url', os.path.basename(json_path))
         if not os.path.isabs(template_path):
             template_path = os.path.join(sys.path[0], template_path)
-        with open(template_path, 'r') as fd:
-            template = Template(fd.read())
-        with open(html_path, 'w') as fd:
-            generated_timestamp_unixtime = int(time.time())
-            generated_timestamp_utc = time.strftime(
-                '%Y-%m-%d %H:%M:%S UTC',
-                time.gmtime(generated_timestamp_unixtime))
-            fd.write(template.render(
-                node_stats=node_stats,
-                generated_timestamp_utc=generated_timestamp_utc,
-                generated_timestamp_unixtime=generated_timestamp_unixtime,
-            ))
+
+        generated_timestamp_unixtime = int(time.time())
+        generated_timestamp_utc = time.strftime(
+            '%Y-%m-%d %H:%M:%S UTC',
+            time.gmtime(generated_timestamp_unixtime))
+        if json_path:
+            write_document(json_path, get_json_document(
+                node_stats, generated_timestamp_unixtime))
+            content_hash = get_content_hash(template_path, None, json_url)
+        else:
+            content_hash = get_content_hash(template_path, node_stats)
+        if os.path.exists(html_path) and \
+                read_content_hash(config) == content_hash:
+            debug('Html document is up to date - skipping it.')
+            return
+
+        template = load_template(
+            template_path, config.get('template_cache_dir'))
+        html = template.render(
+            node_stats=[] if json_path else node_stats,
+            generated_timestamp_utc=generated_timestamp_utc,
+            generated_timestamp_unixtime=generated_timestamp_unixtime,
+            json_url=json_url,
+        )
+        write_document(html_path, html)
+        write_atomic(get_hash_file(config), lambda fd: fd.write(content_hash))
     except:
         raise
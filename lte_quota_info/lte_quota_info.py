@@ -2,12 +2,23 @@
 
 import argparse
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import chain
 
+from lib.backfill import backfill_stats
 from lib.config import read_config
-from lib.log import set_log_level, debug
+from lib.daemon import run_daemon
+from lib.log import set_log_level, debug, warn
+from lib.metrics import export_metrics, start_metrics_server
 from lib.routers import get_lte_nodes
-from lib.stats import collect_stats, calculate_total
-from lib.units import bytes_to_human, human_to_size
+from lib.stats import (
+    collect_counters, flush_stats, import_stats_files, lock_stats,
+    get_forecast, get_history, get_period_end, prepare_stats_dir,
+    update_stats)
+from lib.timings import (
+    begin_run, get_timings, operation, phase, print_timings, write_timings)
+from lib.units import bytes_to_human
 from lib.webpage import create_html_document
 
 
@@ -19,9 +30,162 @@ def parse_arguments():
                         default='/etc/128technology/lte_quota_info.json')
     parser.add_argument('--debug', '-d', action='store_true',
                         help='show debug messages')
+    parser.add_argument('--workers', '-w', type=int,
+                        help='number of nodes to be collected concurrently')
+    parser.add_argument('--refresh-topology', '-r', action='store_true',
+                        help='ignore cached routers/nodes/interfaces')
+    parser.add_argument('--import-stats', action='store_true',
+                        help='convert existing JSON stats files and exit')
+    parser.add_argument('--verify-totals', action='store_true',
+                        help='verify running totals against all samples')
+    parser.add_argument('--daemon', action='store_true',
+                        help='keep running and collect stats every interval')
+    parser.add_argument('--backfill', action='store_true',
+                        help='fill gaps in samples from conductor history')
+    parser.add_argument('--timings', action='store_true',
+                        help='show a summary of timings after each run')
     return parser.parse_args()
 
 
+def get_counters(config, nodes):
+    """Query counters of a chunk of nodes - failures are returned per node."""
+    try:
+        return collect_counters(config, nodes)
+    except (Exception, SystemExit) as e:
+        # fatal() in a worker must not abort the run
+        warn('Cannot collect counters for', len(nodes), 'nodes -', e)
+        return [e] * len(nodes)
+
+
+def get_error_stats(node_info, error):
+    """Prepare an error entry of a node for the document."""
+    if isinstance(error, SystemExit):
+        # the reason has been logged by fatal()
+        error = 'Collecting stats has failed.'
+    return {
+        'router_name': node_info['router'],
+        'node_name': node_info['node'],
+        'interface_name': node_info.get('interface', ''),
+        'error': str(error),
+    }
+
+
+def get_node_stats(config, node_info, stats, verify=False):
+    """Update stats of a single node and prepare them for the document."""
+    router_name = node_info['router']
+    node_name = node_info['node']
+    quota = node_info['quota']
+
+    if isinstance(stats, BaseException):
+        return get_error_stats(node_info, stats)
+    if not stats:
+        debug('No result for router:', router_name, 'node:', node_name)
+        return None
+    try:
+        with operation('update_stats'):
+            checkpoint = update_stats(config, node_info, stats, verify)
+        history = get_history(config, node_info,
+                              config.get('history_days', 30),
+                              checkpoint['timestamp'])
+    except (Exception, SystemExit) as e:
+        # a failing node must not affect the other nodes
+        warn('Cannot update stats for router:', router_name,
+             'node:', node_name, '-', e)
+        return get_error_stats(node_info, e)
+    total = checkpoint['total']
+    percentage = total * 100 / quota
+    projected_total, exhaustion = get_forecast(
+        checkpoint, quota, get_period_end(node_info))
+    projected_string = None
+    if projected_total is not None:
+        projected_string = bytes_to_human(projected_total, html=True)
+
+    # coloring progress bar
+    color = 'bg-success'
+    if percentage > config.get('percentage_orange', 80):
+        color = 'bg-warning'
+    if percentage > config.get('percentage_red', 95):
+        color = 'bg-danger'
+
+    return {
+        'router_name': router_name,
+        'node_name': node_name,
+        'interface_name': node_info.get('interface', ''),
+        'initial_string': bytes_to_human(quota, html=True),
+        'used_string': bytes_to_human(total, html=True),
+        'quota_bytes': quota,
+        'used_bytes': total,
+        'percentage': percentage,
+        'color': color,
+        'timestamp_unixtime': int(time.time()),
+        'timestamp_last_sample': checkpoint['timestamp'],
+        'projected_bytes': projected_total,
+        'projected_string': projected_string,
+        'timestamp_exhaustion': exhaustion,
+        'history': history,
+    }
+
+
+def collect(config, args, refresh=False):
+    """Collect stats of all LTE nodes and create the html document."""
+    workers = args.workers or config.get('workers', 8)
+    batch_size = max(config.get('graphql_batch_size', 100), 1)
+    with phase('discovery'):
+        nodes = get_lte_nodes(config, refresh=refresh)
+    chunks = [nodes[i:i + batch_size]
+              for i in range(0, len(nodes), batch_size)]
+    # executor.map() returns the results in the order of get_lte_nodes()
+    with phase('collection'), \
+            ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        counters = chain.from_iterable(
+            executor.map(partial(get_counters, config), chunks))
+        results = executor.map(
+            partial(get_node_stats, config, verify=args.verify_totals),
+            nodes, counters)
+        node_stats = [stats for stats in results if stats]
+    debug(node_stats)
+    with phase('rendering'):
+        create_html_document(config, node_stats)
+    return node_stats
+
+
+def run(config, args, refresh=False, backfill=False):
+    """Run a collection while holding the lock of stats_dir."""
+    begin_run()
+    with lock_stats(config):
+        with phase('cleanup'):
+            prepare_stats_dir(config)
+        if backfill:
+            # before collecting, so the documents show backfilled totals
+            with phase('backfill'):
+                backfill_stats(config, get_lte_nodes(config, refresh=refresh))
+            refresh = False
+        node_stats = collect(config, args, refresh=refresh)
+        if not args.daemon:
+            with phase('flush'):
+                flush_stats(config)
+    export_metrics(config, node_stats)
+    report_timings(config, args)
+
+
+def report_timings(config, args):
+    """Show and/or append the timings of the last run."""
+    timings_file = config.get('timings_file')
+    if not args.timings and not timings_file:
+        return
+    timings = get_timings()
+    if args.timings:
+        print_timings(timings)
+    if timings_file:
+        write_timings(timings_file, timings)
+
+
+def flush(config):
+    """Persist pending updates while holding the lock of stats_dir."""
+    with lock_stats(config), phase('flush', between_runs=True):
+        flush_stats(config)
+
+
 def main():
     args = parse_arguments()
     log_level = 'INFO'
@@ -30,37 +194,16 @@ def main():
     set_log_level(log_level)
 
     config = read_config(args.config)
-    node_stats = []
-    for node_info in get_lte_nodes(config):
-        router_name = node_info['router']
-        node_name = node_info['node']
-        quota = node_info['quota']
-
-        stats_log = collect_stats(config, node_info)
-        if not stats_log:
-            debug('No result for router:', router_name, 'node:', node_name)
-            continue
-        total = calculate_total(stats_log)
-        percentage = total * 100 / quota
-
-        # coloring progress bar
-        color = 'bg-success'
-        if percentage > config.get('percentage_orange', 80):
-            color = 'bg-warning'
-        if percentage > config.get('percentage_red', 95):
-            color = 'bg-danger'
-
-        node_stats.append({
-            'router_name': router_name,
-            'node_name': node_name,
-            'initial_string': bytes_to_human(quota, html=True),
-            'used_string': bytes_to_human(total, html=True),
-            'percentage': percentage,
-            'color': color,
-            'timestamp_unixtime': int(time.time())
-        })
-    debug(node_stats)
-    create_html_document(config, node_stats)
+    if args.import_stats:
+        with lock_stats(config):
+            import_stats_files(config)
+        return
+    if args.daemon:
+        start_metrics_server(config)
+        run_daemon(args.config, config, partial(run, args=args), flush,
+                   refresh=args.refresh_topology, backfill=args.backfill)
+        return
+    run(config, args, refresh=args.refresh_topology, backfill=args.backfill)
 
 
 if __name__ == '__main__':
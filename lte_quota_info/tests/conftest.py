@@ -0,0 +1,62 @@
+"""Fixtures of the lte_quota_info tests."""
+import os
+import sys
+
+import pytest
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from benchmarks.mock_conductor import Fleet, MockConductor  # noqa: E402
+from lib import routers, stats  # noqa: E402
+from lib.stats import get_stats_store  # noqa: E402
+from lib.session import reset_session  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def reset_caches():
+    """Forget sessions, topologies and stores of previous tests."""
+    yield
+    reset_session()
+    routers._topology.clear()
+    stats._stores.clear()
+
+
+@pytest.fixture
+def conductor():
+    """Mock conductor with a small fleet."""
+    with MockConductor(Fleet(routers=3)) as conductor:
+        yield conductor
+
+
+@pytest.fixture
+def config(conductor, tmp_path):
+    """Config which collects from the mock conductor into tmp_path."""
+    return {
+        'api_key': 'test',
+        'conductor': conductor.url,
+        'default_quota': '5 GB',
+        'quotas': {},
+        'stats_dir': str(tmp_path / 'stats'),
+        'html_path': str(tmp_path / 'lte_quota_info.html'),
+        'html_template': os.path.join(BASE_DIR, 'lte_quota_info.template'),
+        'http_retries': 0,
+    }
+
+
+@pytest.fixture(params=['json', 'binary', 'sqlite'])
+def store_config(request, tmp_path):
+    """Config of a stats store of every format."""
+    stats_dir = tmp_path / 'stats'
+    stats_dir.mkdir()
+    return {'stats_dir': str(stats_dir), 'stats_format': request.param}
+
+
+@pytest.fixture
+def reopen(store_config):
+    """Flush and forget the store, so it is read from disk again."""
+    def reopen():
+        stats.flush_stats(store_config)
+        stats._stores.clear()
+        return get_stats_store(store_config)
+    return reopen
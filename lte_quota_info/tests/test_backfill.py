@@ -0,0 +1,83 @@
+"""Tests of backfilling missed samples from conductor timeseries."""
+import argparse
+import os
+import time
+from datetime import datetime, timezone
+
+import lte_quota_info
+from lib.backfill import backfill_stats, find_gaps, merge_samples
+from lib.routers import get_lte_nodes
+from lib.stats import calculate_total, get_period, get_stats_store
+
+
+def test_find_gaps():
+    stats_log = [[0, 0, 0], [60, 0, 0], [600, 0, 0], [660, 0, 0]]
+    assert find_gaps(stats_log, 120) == [(60, 600)]
+    assert find_gaps(stats_log, 120, 720) == [(60, 600)]
+    assert find_gaps(stats_log, 120, 1000) == [(60, 600), (660, 1000)]
+    assert find_gaps([], 120, 1000) == []
+
+
+def test_merge_samples_thins_next_to_logged_samples():
+    stats_log = [[0, 0, 0], [600, 6, 6]]
+    samples = [[timestamp, timestamp // 100, timestamp // 100]
+               for timestamp in range(30, 600, 30)]
+    merged = merge_samples(stats_log, samples, 120)
+    assert [entry[0] for entry in merged] == [0, 120, 240, 360, 480, 600]
+    # logged samples are kept
+    assert merged[-1] == [600, 6, 6]
+
+
+def test_backfill_before_collecting(config, conductor, monkeypatch):
+    now = time.time()
+    conductor.fleet.start = now - 7200
+    config['interval'] = 60
+    os.makedirs(config['stats_dir'])
+    node_info = get_lte_nodes(config)[0]
+    # the router has been restarted during an outage of 30 minutes
+    store = get_stats_store(config)
+    period = get_period(node_info, now)
+    store.write(node_info, period, [
+        [int(now) - 3600, 10 ** 12, 10 ** 12],
+        [int(now) - 1800, 10 ** 12 + 1000, 10 ** 12 + 1000],
+    ])
+
+    exported = []
+    monkeypatch.setattr(lte_quota_info, 'export_metrics',
+                        lambda config, node_stats: exported.extend(node_stats))
+    args = argparse.Namespace(
+        workers=None, verify_totals=False, daemon=False, timings=False)
+    lte_quota_info.run(config, args, backfill=True)
+
+    stats_log = store.read(node_info, period)
+    assert len(stats_log) > 25
+    # backfilled samples are one per interval (the last one is collected)
+    backfilled = stats_log[:-1]
+    assert all(b[0] - a[0] >= 60 for a, b in zip(backfilled, backfilled[1:]))
+    # the backfilled total is shown by the run which has backfilled it
+    stats = [stats for stats in exported
+             if stats['router_name'] == node_info['router']][0]
+    assert stats['used_bytes'] == calculate_total(stats_log) > 2000
+
+
+def test_backfill_across_cycle_start(config, conductor, monkeypatch):
+    def utc(*args):
+        return int(datetime(*args, tzinfo=timezone.utc).timestamp())
+
+    conductor.fleet.start = utc(2024, 1, 31, 22)
+    node_info = {'router': 'router-00000', 'node': 'node1',
+                 'interface': 'LTE1', 'billing_timezone': 'UTC'}
+    os.makedirs(config['stats_dir'])
+    store = get_stats_store(config)
+    # the outage has started an hour before the cycle of February
+    store.write(node_info, '2024-01', [[utc(2024, 1, 31, 23), 1, 1]])
+    monkeypatch.setattr('time.time', lambda: utc(2024, 2, 1, 0, 30))
+    backfill_stats(config, [node_info])
+
+    january = store.read(node_info, '2024-01')
+    february = store.read(node_info, '2024-02')
+    assert len(january) == 60
+    assert january[-1][0] == utc(2024, 1, 31, 23, 59)
+    assert len(february) == 30
+    assert february[0][0] == utc(2024, 2, 1)
+    assert store.read_state(node_info, '2024-02', 'total')['count'] == 30
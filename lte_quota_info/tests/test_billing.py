@@ -0,0 +1,62 @@
+"""Tests of billing cycles."""
+from datetime import datetime, timezone
+
+import pytest
+
+from lib.stats import (
+    ZoneInfo, get_cycle, get_period, get_period_end, replay_stats)
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc).timestamp()
+
+
+def test_cycles_start_on_the_first():
+    node_info = {'billing_timezone': 'UTC'}
+    assert get_period(node_info, utc(2024, 3, 1)) == '2024-03'
+    assert get_period(node_info, utc(2024, 2, 29, 23, 59, 59)) == '2024-02'
+    assert get_period_end(node_info, utc(2024, 12, 31)) == utc(2025, 1, 1)
+
+
+def test_cycles_start_on_billing_start_day():
+    node_info = {'billing_start_day': 15, 'billing_timezone': 'UTC'}
+    assert get_period(node_info, utc(2024, 3, 15)) == '2024-03-15'
+    assert get_period(node_info, utc(2024, 3, 14, 23, 59, 59)) == \
+        '2024-02-15'
+    # cycles of January start in December of the previous year
+    assert get_period(node_info, utc(2024, 1, 1)) == '2023-12-15'
+    assert get_period_end(node_info, utc(2024, 12, 20)) == utc(2025, 1, 15)
+
+
+def test_cycles_start_on_the_last_day_of_short_months():
+    node_info = {'billing_start_day': 31, 'billing_timezone': 'UTC'}
+    start, end = get_cycle(node_info, utc(2023, 2, 28, 12))
+    assert start.timestamp() == utc(2023, 2, 28)
+    assert end.timestamp() == utc(2023, 3, 31)
+    assert get_period(node_info, utc(2023, 2, 27)) == '2023-01-31'
+    assert get_period(node_info, utc(2024, 2, 29)) == '2024-02-29'
+
+
+@pytest.mark.skipif(ZoneInfo is None, reason='requires zoneinfo')
+def test_cycles_start_in_billing_timezone():
+    node_info = {'billing_start_day': 1, 'billing_timezone': 'Europe/Berlin'}
+    # midnight in Berlin is 23:00 UTC of the previous day in winter
+    assert get_period(node_info, utc(2024, 1, 31, 22, 59, 59)) == '2024-01'
+    assert get_period(node_info, utc(2024, 1, 31, 23)) == '2024-02'
+    # ... and 22:00 UTC in summer
+    assert get_period_end(node_info, utc(2024, 7, 15)) == \
+        utc(2024, 7, 31, 22)
+
+
+@pytest.mark.skipif(ZoneInfo is None, reason='requires zoneinfo')
+def test_rollups_use_billing_timezone():
+    node_info = {'billing_start_day': 1, 'billing_timezone': 'Europe/Berlin'}
+    stats_log = [
+        [utc(2024, 1, 31, 22, 30), 100, 0],
+        [utc(2024, 1, 31, 23, 30), 300, 0],
+    ]
+    # the last sample is part of February's cycle and of its first day
+    assert get_period(node_info, stats_log[1][0]) == '2024-02'
+    rollup = replay_stats(stats_log, node_info)[1]
+    assert rollup['daily'] == {'2024-01-31': 0, '2024-02-01': 200}
+    assert rollup['hourly'] == {'2024-01-31 23:00': 0, '2024-02-01 00:00': 200}
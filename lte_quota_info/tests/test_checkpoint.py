@@ -0,0 +1,33 @@
+"""Tests of the running total checkpoints."""
+from lib.stats import (
+    calculate_total, get_period, get_stats_store, update_stats)
+
+NODE_INFO = {'router': 'router', 'node': 'node1', 'interface': 'LTE1'}
+# counters with a router restart at the 4th sample
+SAMPLES = [
+    [1700000000, 100, 10],
+    [1700000060, 300, 60],
+    [1700000120, 700, 160],
+    [1700000180, 50, 5],
+    [1700000240, 250, 55],
+]
+
+
+def test_update_stats_across_runs(store_config, reopen):
+    # every sample is collected by a separate run
+    for sample in SAMPLES:
+        checkpoint = update_stats(store_config, NODE_INFO, sample,
+                                  verify=True)
+        reopen()
+    assert checkpoint['count'] == len(SAMPLES)
+    assert checkpoint['total'] == calculate_total(SAMPLES) == 1000
+
+
+def test_replay_of_missing_checkpoint(store_config, reopen):
+    store = get_stats_store(store_config)
+    period = get_period(NODE_INFO, SAMPLES[0][0])
+    store.write(NODE_INFO, period, SAMPLES[:-1])
+    reopen()
+
+    checkpoint = update_stats(store_config, NODE_INFO, SAMPLES[-1])
+    assert checkpoint['total'] == calculate_total(SAMPLES)
@@ -0,0 +1,54 @@
+"""Tests of a collection run against the mock conductor."""
+import argparse
+import os
+
+import pytest
+
+import lte_quota_info
+from lib.log import fatal
+
+
+@pytest.fixture
+def config(config):
+    os.makedirs(config['stats_dir'])
+    return config
+
+
+def get_args():
+    return argparse.Namespace(
+        workers=None, verify_totals=False, daemon=False, timings=False)
+
+
+def test_collect(config):
+    node_stats = lte_quota_info.collect(config, get_args())
+    assert [stats['router_name'] for stats in node_stats] == [
+        'router-00000', 'router-00001', 'router-00002']
+    assert all('error' not in stats for stats in node_stats)
+    assert all(len(stats['history']) == 30 for stats in node_stats)
+
+
+def test_fatal_counters_of_a_chunk(config, monkeypatch):
+    collect_counters = lte_quota_info.collect_counters
+
+    def fail_router(config, nodes):
+        if nodes[0]['router'] == 'router-00001':
+            fatal('Cannot query counters.')
+        return collect_counters(config, nodes)
+
+    config['graphql_batch_size'] = 1
+    monkeypatch.setattr(lte_quota_info, 'collect_counters', fail_router)
+    node_stats = lte_quota_info.collect(config, get_args())
+    assert ['error' in stats for stats in node_stats] == [False, True, False]
+
+
+def test_fatal_update_of_a_node(config, monkeypatch):
+    update_stats = lte_quota_info.update_stats
+
+    def fail_router(config, node_info, stats, verify=False):
+        if node_info['router'] == 'router-00002':
+            fatal('Cannot write samples file.')
+        return update_stats(config, node_info, stats, verify)
+
+    monkeypatch.setattr(lte_quota_info, 'update_stats', fail_router)
+    node_stats = lte_quota_info.collect(config, get_args())
+    assert ['error' in stats for stats in node_stats] == [False, False, True]
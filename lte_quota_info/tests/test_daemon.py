@@ -0,0 +1,88 @@
+"""Tests of the long-running collector mode."""
+import glob
+import json
+import os
+import signal
+import sys
+import threading
+
+import pytest
+
+import lte_quota_info
+from lib.log import fatal
+from lib.store import count_samples
+
+
+@pytest.fixture
+def signal_handlers():
+    """Restore the signal handlers which are replaced by the daemon."""
+    handlers = {signum: signal.getsignal(signum)
+                for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP)}
+    yield
+    for signum, handler in handlers.items():
+        signal.signal(signum, handler)
+
+
+def run_daemon(config, tmp_path, monkeypatch, seconds):
+    """Run main() with --daemon until SIGTERM after n seconds."""
+    config_file = tmp_path / 'config.json'
+    config_file.write_text(json.dumps(config))
+    monkeypatch.setattr(sys, 'argv', [
+        'lte_quota_info.py', '--daemon', '-c', str(config_file)])
+    timer = threading.Timer(
+        seconds, os.kill, (os.getpid(), signal.SIGTERM))
+    timer.start()
+    try:
+        lte_quota_info.main()
+    finally:
+        timer.cancel()
+
+
+def test_daemon_collects_samples(config, tmp_path, monkeypatch,
+                                 signal_handlers):
+    config.update(interval=0.2, flush_interval=3600)
+    run_daemon(config, tmp_path, monkeypatch, 1)
+
+    # samples are flushed on SIGTERM
+    files = glob.glob(os.path.join(config['stats_dir'], '*.samples'))
+    assert len(files) == 3
+    for filename in files:
+        assert count_samples(filename) >= 2
+    assert os.path.exists(config['html_path'])
+
+
+def test_daemon_survives_fatal(config, tmp_path, monkeypatch,
+                               signal_handlers):
+    calls = []
+
+    def fail(*args, **kwargs):
+        calls.append(args)
+        sys.exit(1)
+
+    monkeypatch.setattr(lte_quota_info, 'collect', fail)
+    config.update(interval=0.2)
+    run_daemon(config, tmp_path, monkeypatch, 0.7)
+    assert len(calls) >= 2
+
+
+def test_daemon_survives_failing_flush(config, tmp_path, monkeypatch,
+                                       signal_handlers):
+    flush_stats = lte_quota_info.flush_stats
+    calls = []
+
+    def fail_twice(config):
+        calls.append(config)
+        if len(calls) <= 2:
+            fatal('Cannot write stats files: No space left on device')
+        flush_stats(config)
+
+    monkeypatch.setattr(lte_quota_info, 'flush_stats', fail_twice)
+    config.update(interval=0.2, flush_interval=0)
+    run_daemon(config, tmp_path, monkeypatch, 1)
+
+    # the samples of the failed flushes are written by a later one
+    assert len(calls) > 3
+    files = glob.glob(os.path.join(config['stats_dir'], '*.samples'))
+    assert len(files) == 3
+    for filename in files:
+        assert count_samples(filename) >= 4
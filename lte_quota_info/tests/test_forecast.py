@@ -0,0 +1,66 @@
+"""Tests of the burn rate and the forecast of quota usage."""
+import pytest
+
+import lte_quota_info
+from lib.stats import (
+    EXHAUSTION_RESOLUTION, create_checkpoint, get_forecast, get_rate,
+    replay_stats)
+
+
+def test_rate_is_the_average_of_the_first_samples():
+    # 10 bytes per second, then 20 bytes per second
+    checkpoint = create_checkpoint([[0, 1, 0], [60, 601, 0]])
+    assert get_rate(checkpoint) == pytest.approx(10)
+    checkpoint = create_checkpoint([[0, 1, 0], [60, 601, 0], [120, 1801, 0]])
+    assert get_rate(checkpoint) == pytest.approx(15, rel=1e-3)
+    assert get_rate(create_checkpoint([[0, 1, 0]])) is None
+
+
+def test_rate_survives_counter_resets():
+    stats_log = [[i * 60, 1 + i * 600, 0] for i in range(10)]
+    # the router restarts between two samples
+    stats_log += [[600 + i * 60, 1 + i * 600, 0] for i in range(10)]
+    checkpoint = create_checkpoint(stats_log)
+    assert checkpoint['total'] == 18 * 600
+    # the sample after the restart has no usage
+    assert 9 < get_rate(checkpoint) < 10
+
+
+def test_forecast_projects_exhaustion():
+    checkpoint = create_checkpoint([[0, 1, 0], [60, 601, 0]])
+    projected_total, exhaustion = get_forecast(checkpoint, 100000, 86400)
+    assert projected_total == pytest.approx(864000, rel=1e-3)
+    # exceeded at 60 + 99400 / 10 seconds, rounded up to the hour
+    assert exhaustion == 10800
+    assert exhaustion % EXHAUSTION_RESOLUTION == 0
+    # not exceeded within the period
+    assert get_forecast(checkpoint, 100000, 3600)[1] is None
+
+
+def test_forecast_keeps_time_quota_has_been_exceeded():
+    node_info = {'quota': 1000}
+    stats_log = [[i * 60, 1 + i * 600, 0] for i in range(5)]
+    checkpoint = replay_stats(stats_log, node_info)[0]
+    # the total has exceeded the quota with the sample at 120
+    assert get_forecast(checkpoint, 1000, 86400)[1] == 120
+    # ... the time is not the time of the last sample
+    assert checkpoint['timestamp'] == 240
+    # the quota has been raised
+    assert get_forecast(checkpoint, 2000, 86400)[1] == 240
+    assert replay_stats(stats_log, {'quota': 2000})[0]['exceeded'] == \
+        [2000, 240]
+
+
+def test_exhaustion_is_stable_across_runs(tmp_path):
+    config = {'stats_dir': str(tmp_path)}
+    node_info = {'router': 'router', 'node': 'node1', 'interface': 'LTE1',
+                 'billing_timezone': 'UTC', 'quota': 1000}
+    exhaustions = []
+    for i in range(5):
+        node_stats = lte_quota_info.get_node_stats(
+            config, node_info, [1700000000 + i * 60, 1 + i * 600, 0])
+        exhaustions.append(node_stats['timestamp_exhaustion'])
+    # 10 bytes per second exceed the quota within the hour
+    assert exhaustions[0] is None
+    assert exhaustions[1] == 1700002800
+    assert exhaustions[2:] == [1700000120] * 3
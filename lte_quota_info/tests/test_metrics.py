@@ -0,0 +1,113 @@
+"""Tests of the Prometheus metrics."""
+import socket
+import urllib.request
+
+import pytest
+
+from lib.metrics import (
+    CONTENT_TYPE, export_metrics, format_metric, format_metrics,
+    start_metrics_server)
+from lib.timings import observe_request
+
+NODE_STATS = [{
+    'router_name': 'router',
+    'node_name': 'node1',
+    'interface_name': 'LTE1',
+    'used_bytes': 1000,
+    'quota_bytes': 5000,
+    'percentage': 20.0,
+    'timestamp_last_sample': 1700000000,
+    'projected_bytes': 4000,
+    'timestamp_exhaustion': None,
+}, {
+    'router_name': 'router',
+    'node_name': 'node2',
+    'interface_name': 'LTE1',
+    'error': 'Cannot connect',
+}]
+
+
+def get_samples(exposition):
+    """Return {name and labels: value} of a text exposition."""
+    samples = {}
+    for line in exposition.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = value
+    return samples
+
+
+def get_free_port():
+    """Return a port on localhost which is not in use."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_labels_are_escaped():
+    assert format_metric('m', {}, 1) == 'm 1'
+    assert format_metric('m', {'router': 'a"b\\c\nd'}, 1) == \
+        'm{router="a\\"b\\\\c\\nd"} 1'
+
+
+def test_usage_of_nodes():
+    exposition = format_metrics(NODE_STATS)
+    samples = get_samples(exposition)
+    node1 = '{router="router",node="node1",interface="LTE1"}'
+    node2 = '{router="router",node="node2",interface="LTE1"}'
+    assert samples['lte_quota_used_bytes' + node1] == '1000'
+    assert samples['lte_quota_limit_bytes' + node1] == '5000'
+    assert samples['lte_quota_used_percent' + node1] == '20.0'
+    assert samples['lte_quota_projected_bytes' + node1] == '4000'
+    assert samples['lte_quota_collect_error' + node1] == '0'
+    assert samples['lte_quota_collect_error' + node2] == '1'
+    # a node without stats has an error only
+    assert 'lte_quota_used_bytes' + node2 not in samples
+    # families without samples are still described
+    assert '# TYPE lte_quota_projected_exhaustion_timestamp_seconds gauge' \
+        in exposition.splitlines()
+    assert not any(name.startswith(
+        'lte_quota_projected_exhaustion_timestamp_seconds{')
+        for name in samples)
+
+
+def test_request_latency_histogram():
+    for duration in (0.01, 0.2, 0.2, 20):
+        observe_request('test', '/histogram', duration,
+                        failed=duration > 10)
+    samples = get_samples(format_metrics([]))
+    name = 'lte_quota_info_api_request_duration_seconds'
+    labels = 'api="test",endpoint="/histogram"'
+    # buckets are cumulative
+    assert samples[name + '_bucket{' + labels + ',le="0.05"}'] == '1'
+    assert samples[name + '_bucket{' + labels + ',le="0.25"}'] == '3'
+    assert samples[name + '_bucket{' + labels + ',le="10"}'] == '3'
+    assert samples[name + '_bucket{' + labels + ',le="+Inf"}'] == '4'
+    assert samples[name + '_count{' + labels + '}'] == '4'
+    assert float(samples[name + '_sum{' + labels + '}']) == \
+        pytest.approx(20.41)
+    assert samples['lte_quota_info_api_failures_total{' + labels + '}'] == '1'
+
+
+def test_metrics_are_exported(tmp_path):
+    textfile = str(tmp_path / 'lte_quota_info.prom')
+    config = {'prometheus_textfile': textfile, 'prometheus_port': 0}
+    export_metrics(config, NODE_STATS)
+    with open(textfile) as fd:
+        exposition = fd.read()
+    assert 'lte_quota_used_bytes{' in exposition
+
+    # port 0 disables the metrics server
+    assert start_metrics_server(config) is None
+    config['prometheus_address'] = '127.0.0.1'
+    config['prometheus_port'] = get_free_port()
+    server = start_metrics_server(config)
+    try:
+        url = 'http://127.0.0.1:{}/metrics'.format(config['prometheus_port'])
+        with urllib.request.urlopen(url) as response:
+            assert response.headers['Content-Type'] == CONTENT_TYPE
+            assert response.read().decode() == exposition
+    finally:
+        server.shutdown()
+        server.server_close()
+
@@ -0,0 +1,71 @@
+"""Tests of the REST API client."""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from lib import restapi
+from lib.restapi import RestApi
+from lib.session import create_session
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    """Answer /api/v1/{status} with that status."""
+
+    def do_GET(self):
+        self.server.requests += 1
+        self.send_response(int(self.path.split('/')[-1]))
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StatusHandler)
+    server.requests = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def messages(monkeypatch):
+    """Messages of fatal(), which raises SystemExit like the original."""
+    messages = []
+
+    def fatal(*args):
+        messages.append(' '.join(map(str, args)))
+        raise SystemExit(1)
+
+    monkeypatch.setattr(restapi, 'fatal', fatal)
+    return messages
+
+
+def get(server, status, retries=0):
+    api = RestApi('key', 'http://127.0.0.1:{}'.format(server.server_port),
+                  session=create_session(retries=retries, backoff=0))
+    return api.get('/{}'.format(status))
+
+
+@pytest.mark.parametrize('status', [401, 403])
+def test_invalid_credentials(server, messages, status):
+    with pytest.raises(SystemExit):
+        get(server, status)
+    assert messages == ['REST API credentials are invalid.']
+
+
+def test_server_error_after_retries(server, messages):
+    with pytest.raises(SystemExit):
+        get(server, 503, retries=2)
+    assert server.requests == 3
+    assert messages == ['REST API request has failed: HTTP 503 for /503']
+
+
+def test_success(server, messages):
+    assert get(server, 200).status_code == 200
+    assert messages == []
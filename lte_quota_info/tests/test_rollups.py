@@ -0,0 +1,42 @@
+"""Tests of the hourly/daily rollups and the usage history."""
+from datetime import datetime, timezone
+
+from lib.stats import get_history, replay_stats, update_stats
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc).timestamp()
+
+
+def test_rollups_sum_usage_per_hour_and_day():
+    node_info = {'billing_timezone': 'UTC'}
+    stats_log = [
+        [utc(2024, 1, 1, 23, 30), 100, 10],
+        [utc(2024, 1, 1, 23, 45), 200, 20],
+        [utc(2024, 1, 2, 0, 15), 400, 40],
+        # the router restarts
+        [utc(2024, 1, 2, 1, 15), 50, 5],
+        [utc(2024, 1, 2, 1, 30), 150, 5],
+    ]
+    rollup = replay_stats(stats_log, node_info)[1]
+    assert rollup['hourly'] == {
+        '2024-01-01 23:00': 110,
+        '2024-01-02 00:00': 220,
+        '2024-01-02 01:00': 100,
+    }
+    assert rollup['daily'] == {'2024-01-01': 110, '2024-01-02': 320}
+
+
+def test_history_spans_periods(tmp_path):
+    config = {'stats_dir': str(tmp_path)}
+    node_info = {'router': 'router', 'node': 'node1', 'interface': 'LTE1',
+                 'billing_timezone': 'UTC'}
+    # usage of one day before and one day after a cycle boundary
+    for sample in ([utc(2024, 1, 30, 12), 100, 10],
+                   [utc(2024, 1, 31, 12), 300, 10],
+                   [utc(2024, 2, 1, 1), 1000, 10],
+                   [utc(2024, 2, 1, 12), 1300, 10]):
+        update_stats(config, node_info, sample)
+    assert get_history(config, node_info, 4, utc(2024, 2, 1, 12)) == [
+        0, 0, 200, 300]
+    assert get_history(config, node_info, 0) == []
@@ -0,0 +1,52 @@
+"""Tests of the cached LTE topology."""
+import os
+
+from lib import routers
+from lib.routers import get_lte_nodes
+
+
+def discover(config, conductor, refresh=False):
+    """Return the number of API requests of a discovery."""
+    requests = conductor.requests
+    # every run is a new process
+    routers._topology.clear()
+    nodes = get_lte_nodes(config, refresh=refresh)
+    assert len(nodes) == 3
+    return conductor.requests - requests
+
+
+def test_topology_is_cached(config, conductor):
+    os.makedirs(config['stats_dir'])
+    assert discover(config, conductor) > 0
+    assert discover(config, conductor) == 0
+    # --refresh-topology
+    assert discover(config, conductor, refresh=True) > 0
+
+
+def test_topology_cache_expires(config, conductor, monkeypatch):
+    config['topology_ttl'] = 60
+    os.makedirs(config['stats_dir'])
+    assert discover(config, conductor) > 0
+    now = routers._topology[routers.get_topology_file(config)]['timestamp']
+    monkeypatch.setattr('time.time', lambda: now + 60)
+    assert discover(config, conductor) == 0
+    monkeypatch.setattr('time.time', lambda: now + 61)
+    assert discover(config, conductor) > 0
+
+
+def test_topology_cache_can_be_disabled(config, conductor):
+    config['topology_ttl'] = 0
+    os.makedirs(config['stats_dir'])
+    assert discover(config, conductor) > 0
+    assert discover(config, conductor) > 0
+    assert not os.path.exists(routers.get_topology_file(config))
+
+
+def test_topology_is_discovered_on_config_changes(config, conductor):
+    config['topology_check_config_version'] = True
+    os.makedirs(config['stats_dir'])
+    assert discover(config, conductor) > 0
+    # only the config version is requested
+    assert discover(config, conductor) == 1
+    conductor.fleet.config_version = '2'
+    assert discover(config, conductor) > 1
@@ -0,0 +1,29 @@
+"""Tests of the SQLite stats store."""
+from lib.stats import get_stats_store
+
+NODE_INFO = {'router': 'router', 'node': 'node1', 'interface': 'LTE1'}
+SAMPLES = [
+    [1700000000, 100, 10],
+    [1700000060, 300, 60],
+    [1700000120, 700, 160],
+]
+
+
+def test_sqlite_cleanup_keeps_running_periods(tmp_path, monkeypatch):
+    config = {'stats_dir': str(tmp_path), 'stats_format': 'sqlite'}
+    store = get_stats_store(config)
+    old = dict(NODE_INFO, node='node2')
+    now = SAMPLES[-1][0] + 10 * 86400
+    monkeypatch.setattr('time.time', lambda: SAMPLES[-1][0])
+    for node_info in (NODE_INFO, old):
+        store.write(node_info, '2023-11', SAMPLES)
+        store.write_state(node_info, '2023-11', 'total', {})
+    monkeypatch.setattr('time.time', lambda: now)
+    store.append(NODE_INFO, '2023-11', [now, 900, 300])
+    store.write_state(NODE_INFO, '2023-11', 'total', {})
+    store.cleanup(7)
+
+    # samples older than 7 days are kept while their period is running
+    assert store.read(NODE_INFO, '2023-11') == SAMPLES + [[now, 900, 300]]
+    assert store.read(old, '2023-11') == []
+    assert store.read_state(old, '2023-11', 'total') is None
@@ -0,0 +1,70 @@
+"""Tests of the stats stores."""
+import os
+
+from lib import stats
+from lib.stats import get_period, get_stats_store, replay_stats
+from lib.store import RECORD, read_samples
+
+NODE_INFO = {'router': 'router', 'node': 'node1', 'interface': 'LTE1'}
+# counters with a router restart at the 4th sample
+SAMPLES = [
+    [1700000000, 100, 10],
+    [1700000060, 300, 60],
+    [1700000120, 700, 160],
+    [1700000180, 50, 5],
+    [1700000240, 250, 55],
+]
+
+
+def test_round_trip(store_config, reopen):
+    store = get_stats_store(store_config)
+    period = get_period(NODE_INFO, SAMPLES[0][0])
+    for sample in SAMPLES:
+        store.append(NODE_INFO, period, sample)
+
+    store = reopen()
+    assert store.read(NODE_INFO, period) == SAMPLES
+    assert store.count(NODE_INFO, period) == len(SAMPLES)
+
+
+def test_state_round_trip(store_config, reopen):
+    store = get_stats_store(store_config)
+    period = get_period(NODE_INFO, SAMPLES[0][0])
+    checkpoint, rollup = replay_stats(SAMPLES)
+    store.write_state(NODE_INFO, period, 'total', checkpoint)
+    store.write_state(NODE_INFO, period, 'rollup', rollup)
+
+    store = reopen()
+    assert store.read_state(NODE_INFO, period, 'total') == checkpoint
+    assert store.read_state(NODE_INFO, period, 'rollup') == rollup
+
+
+def test_binary_store_drops_incomplete_record(tmp_path):
+    config = {'stats_dir': str(tmp_path), 'stats_format': 'binary'}
+    store = get_stats_store(config)
+    period = get_period(NODE_INFO, SAMPLES[0][0])
+    store.append(NODE_INFO, period, SAMPLES[0])
+    stats.flush_stats(config)
+    # a run has been interrupted while appending a record
+    filename = store.get_path(NODE_INFO, period)
+    with open(filename, 'ab') as fd:
+        fd.write(b'\0' * 5)
+    assert read_samples(filename) == SAMPLES[:1]
+
+    store.append(NODE_INFO, period, SAMPLES[1])
+    stats.flush_stats(config)
+    assert os.path.getsize(filename) == 2 * RECORD.size
+    assert read_samples(filename) == SAMPLES[:2]
+
+
+def test_binary_store_imports_json_stats(tmp_path):
+    config = {'stats_dir': str(tmp_path), 'stats_format': 'json'}
+    period = get_period(NODE_INFO, SAMPLES[0][0])
+    get_stats_store(config).write(NODE_INFO, period, SAMPLES)
+    stats.flush_stats(config)
+    stats._stores.clear()
+
+    config['stats_format'] = 'binary'
+    store = get_stats_store(config)
+    assert store.read(NODE_INFO, period) == SAMPLES
+    assert os.path.exists(store.get_path(NODE_INFO, period))
@@ -0,0 +1,25 @@
+"""Tests of the run timings."""
+from lib.store import write_atomic, write_json
+from lib.timings import begin_run, get_phases, get_timings, phase
+
+
+def test_only_stats_files_are_counted(tmp_path):
+    begin_run()
+    write_atomic(str(tmp_path / 'page.html'), lambda fd: fd.write('html'))
+    write_json({}, str(tmp_path / 'topology.json'))
+    assert get_timings()['bytes'].get('stats_written', 0) == 0
+
+    write_json([[1, 2, 3]], str(tmp_path / 'node.stats'),
+               kind='stats_written')
+    assert get_timings()['bytes']['stats_written'] == len('[[1, 2, 3]]')
+
+
+def test_flush_between_runs_is_kept():
+    begin_run()
+    with phase('flush', between_runs=True):
+        pass
+    begin_run()
+    with phase('collection'):
+        pass
+    assert set(get_phases()) == {'flush', 'collection'}
+    assert set(get_timings()['phases']) == {'flush', 'collection'}
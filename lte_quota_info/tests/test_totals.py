@@ -0,0 +1,36 @@
+"""Tests of the calculation of totals."""
+import random
+
+import pytest
+
+from lib.stats import (
+    calculate_total, calculate_total_vectorized, create_checkpoint)
+
+
+def create_stats_log(count, seed):
+    """Return samples with router restarts and zero counters."""
+    rng = random.Random(seed)
+    stats_log = []
+    received = sent = 0
+    for i in range(count):
+        if rng.random() < 0.05:
+            received = sent = 0
+        elif rng.random() < 0.02:
+            # only one counter is reset
+            sent = rng.randint(0, 100)
+        received += rng.choice((0, rng.randint(0, 100000)))
+        sent += rng.choice((0, rng.randint(0, 25000)))
+        stats_log.append([1700000000 + i * 60, received, sent])
+    return stats_log
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_totals_are_equivalent(seed):
+    stats_log = create_stats_log(500, seed)
+    total = calculate_total(stats_log)
+    assert calculate_total_vectorized(stats_log) == total
+    assert create_checkpoint(stats_log)['total'] == total
+    # checkpoints are updated sample by sample
+    for count in (1, 2, 250):
+        assert create_checkpoint(stats_log[:count])['total'] == \
+            calculate_total(stats_log[:count])
@@ -0,0 +1,62 @@
+"""Tests of the html/JSON documents."""
+import json
+import os
+
+from lib.webpage import create_html_document
+
+
+def get_node_stats(used_string='1&nbsp;GB'):
+    return [{
+        'router_name': 'router',
+        'node_name': 'node1',
+        'initial_string': '5&nbsp;GB',
+        'used_string': used_string,
+        'percentage': 20.0,
+        'color': 'bg-success',
+        'timestamp_unixtime': 1,
+    }]
+
+
+def test_json_document_is_written_every_run(config, tmp_path):
+    config['json_path'] = str(tmp_path / 'lte_quota_info.json')
+    os.makedirs(config['stats_dir'])
+    create_html_document(config, get_node_stats())
+    os.utime(config['html_path'], ns=(1, 1))
+
+    create_html_document(config, get_node_stats('2&nbsp;GB'))
+    with open(config['json_path']) as fd:
+        document = json.load(fd)
+    row = dict(zip(document['fields'], document['nodes'][0]))
+    assert row['used_string'] == '2&nbsp;GB'
+    # the html document does not depend on the stats
+    assert os.stat(config['html_path']).st_mtime_ns == 1
+
+
+def test_html_document_is_written_on_changes(config):
+    os.makedirs(config['stats_dir'])
+    create_html_document(config, get_node_stats())
+    os.utime(config['html_path'], ns=(1, 1))
+    create_html_document(config, get_node_stats())
+    assert os.stat(config['html_path']).st_mtime_ns == 1
+
+    create_html_document(config, get_node_stats('2&nbsp;GB'))
+    with open(config['html_path']) as fd:
+        assert '2&nbsp;GB' in fd.read()
+
+
+def test_html_document_is_written_on_new_exhaustion(config):
+    os.makedirs(config['stats_dir'])
+    node_stats = get_node_stats()
+    node_stats[0]['projected_string'] = '6&nbsp;GB'
+    create_html_document(config, node_stats)
+    os.utime(config['html_path'], ns=(1, 1))
+
+    # a new run only changes the volatile timestamps
+    node_stats[0].update(timestamp_unixtime=2, timestamp_last_sample=2)
+    create_html_document(config, node_stats)
+    assert os.stat(config['html_path']).st_mtime_ns == 1
+
+    node_stats[0]['timestamp_exhaustion'] = 1700000000
+    create_html_document(config, node_stats)
+    with open(config['html_path']) as fd:
+        assert 'ts="1700000000"' in fd.read()
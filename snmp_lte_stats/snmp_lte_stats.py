@@ -1,18 +1,30 @@
 #!/usr/bin/env python3
 
 import argparse
+import base64
+import bisect
+import fcntl
 import json
 import os
 import pathlib
 import requests
 import sys
+import threading
 import time
+from contextlib import contextmanager
 
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
 CACHE_TIMEOUT = 30  # in seconds
+CACHE_GRACE = 300  # in seconds - expired stats are served while refreshing
 CACHE_FILE = '/var/run/128technology/snmp_lte_stats.cache'
+LOCK_FILE = '/var/run/128technology/snmp_lte_stats.lock'
+COUNTERS_FILE = '/var/run/128technology/snmp_lte_stats.counters'
+TOKEN_REFRESH_MARGIN = 300  # in seconds - login before the token expires
+INDEX_FILE = '/var/lib/128technology/snmp_lte_stats.index'
+INTERFACE_TYPE = 'lte'
+LTE_QUERY = '{ allRouters { nodes { nodes { nodes { name deviceInterfaces { nodes { name type networkInterfaces { nodes { deviceInterface { state { networkPluginState } } } } } } } } } } }'
 BASE = '.1.3.6.1.4.1.45956.1.'
 STATS = (
     'Radio Interface',
@@ -31,16 +43,84 @@ TYPES = {
     'RSSI Signal Strength' : 'integer',
 }
 NETWORK_TYPES = ('none', 'gsm', 'umts', 'lte')
+# cache counters as 100.3.{n}
+COUNTERS = (
+    ('hits', 'counter'),
+    ('stale_hits', 'counter'),
+    ('misses', 'counter'),
+    ('refreshes', 'counter'),
+    ('refresh_failures', 'counter'),
+    ('last_refresh_ms', 'gauge'),
+    ('refresh_ms', 'counter'),
+)
 
 
 class UnauthorizedException(Exception):
     pass
 
+
+def get_token_expiry(token):
+    """Return the expiry of a JWT as unix time - None if it is unknown."""
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return int(json.loads(base64.urlsafe_b64decode(payload))['exp'])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def token_expires_soon(token):
+    expiry = get_token_expiry(token)
+    return expiry is not None and expiry - time.time() < TOKEN_REFRESH_MARGIN
+
+
+class TokenManager(object):
+    """Token which is shared by all processes through the token file.
+
+    Only one thread/process logs in at a time (by an exclusive lock of
+    the token file). Others use the token of the last login.
+    """
+
+    def __init__(self, token_file, login):
+        self.token_file = token_file
+        self.lock_file = token_file + '.lock'
+        self.login = login
+        self.lock = threading.Lock()
+        self.token = self.read()
+
+    def read(self):
+        try:
+            with open(self.token_file) as fd:
+                return fd.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def get(self):
+        """Return the token - login if there is none or it expires soon."""
+        token = self.token
+        if token and not token_expires_soon(token):
+            return token
+        return self.refresh(token)
+
+    def refresh(self, expired_token):
+        """Replace an expired token - by the token of another process if
+        it has logged in meanwhile."""
+        with self.lock, open(self.lock_file, 'a') as fd:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            token = self.read()
+            if token and token != expired_token and \
+                    not token_expires_soon(token):
+                self.token = token
+                return token
+            token = self.login()
+            write_atomic(self.token_file, token)
+            self.token = token
+            return token
+
+
 class RestGraphqlApi(object):
     """Representation of REST connection."""
 
-    token = None
-    authorized = False
     headers = {
         'Content-Type': 'application/json',
     }
@@ -54,44 +134,35 @@ class RestGraphqlApi(object):
         self.user_agent = basename
         self.token_file = os.path.join(
              pathlib.Path.home(), '.{}.token'.format(basename))
-        self.read_token()
-        self.headers.update({
-             'User-Agent': self.user_agent,
-             'Authorization': f'Bearer {self.token}',
-        })
+        self.tokens = TokenManager(self.token_file, self.login)
 
+        # the session keeps its connection alive between requests
         self.session = requests.Session()
         self.session.headers.update(self.headers)
+        self.session.headers['User-Agent'] = self.user_agent
         self.session.hooks['response'].append(self.refresh_token)
 
-    def read_token(self):
-        try:
-            with open(self.token_file) as fd:
-                self.token = fd.read()
-        except FileNotFoundError:
-            pass
-
-    def write_token(self):
-        try:
-            with open(self.token_file, 'w') as fd:
-                fd.write(self.token)
-        except:
-            raise
-
     def refresh_token(self, r, *args, **kwargs):
-        if r.status_code == 401:
-            token = self.login()
-            self.session.headers.update({'Authorization': f'Bearer {token}'})
-            r.request.headers['Authorization'] = self.session.headers['Authorization']
+        authorization = r.request.headers.get('Authorization')
+        if r.status_code == 401 and authorization:
+            token = self.tokens.refresh(authorization[len('Bearer '):])
+            r.request.headers['Authorization'] = f'Bearer {token}'
+            # retry only once
+            r.request.deregister_hook('response', self.refresh_token)
             return self.session.send(r.request, verify=self.verify)
 
     def post(self, location, json, authorization_required=True):
         """Send data per REST API via post."""
         url = 'https://{}/api/v1/{}'.format(self.host, location.strip('/'))
-        request = self.session.post(url, json=json, verify=self.verify)
+        headers = {}
+        if authorization_required:
+            headers['Authorization'] = f'Bearer {self.tokens.get()}'
+        request = self.session.post(
+            url, json=json, headers=headers, verify=self.verify)
         return request
 
     def login(self):
+        """Login and return a new token."""
         json = {
             'username': self.user,
         }
@@ -108,9 +179,7 @@ class RestGraphqlApi(object):
             json['local'] = key_content
         request = self.post('/login', json, authorization_required=False)
         if request.status_code == 200:
-            self.token = request.json()['token']
-            self.write_token()
-            return self.token
+            return request.json()['token']
         else:
             message = request.json()['message']
             raise UnauthorizedException(message)
@@ -120,47 +189,221 @@ def parse_arguments():
     """Get commandline arguments."""
     parser = argparse.ArgumentParser(
         description='Provide LTE stats through SNMP')
-    parser.add_argument('oid', help='the OID')
+    parser.add_argument('oid', nargs='?', help='the OID')
     parser.add_argument('-g', '--get', help='get value', action='store_true')
     parser.add_argument('-n',  '--next', help='get next value', action='store_true')
-    return parser.parse_args()
+    parser.add_argument('-s', '--set', nargs=2, metavar=('TYPE', 'VALUE'),
+                        help='set value (objects are not writable)')
+    parser.add_argument('-p', '--persist', action='store_true',
+                        help='run as long-lived snmpd pass_persist process')
+    args = parser.parse_args()
+    if not args.persist and not args.oid:
+        parser.error('the OID is required unless --persist is given')
+    return args
 
 
 def error(*msg):
-    print(*msg)
+    # stdout is reserved for the replies to snmpd
+    print(*msg, file=sys.stderr)
     sys.exit(1)
 
 
 def read_cache():
+    """Return age and LTE modems of the cache - (None, None) if missing."""
     try:
-        timestamp = os.stat(CACHE_FILE).st_mtime
-        now = time.time()
-        if now - timestamp > CACHE_TIMEOUT:
-            # cache has expired
-            return {}
-
         with open(CACHE_FILE) as fd:
-            lte_stats = json.load(fd)
-            return lte_stats
+            age = time.time() - os.fstat(fd.fileno()).st_mtime
+            # caches of older versions have no modems
+            modems = json.load(fd).get('modems')
+    except (FileNotFoundError, ValueError, AttributeError):
+        return None, None
+    if modems is None:
+        return None, None
+    return age, modems
+
+
+def write_atomic(filename, content):
+    """Write a file atomically - readers never see an incomplete file."""
+    tmp_filename = '{}.{}.{}.tmp'.format(
+        filename, os.getpid(), threading.get_ident())
+    try:
+        with open(tmp_filename, 'w') as fd:
+            fd.write(content)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.unlink(tmp_filename)
+        raise
+
 
-    except FileNotFoundError:
+def write_cache(modems):
+    write_atomic(CACHE_FILE, json.dumps({'modems': modems}))
+
+
+@contextmanager
+def cache_lock(blocking=True):
+    """Hold the exclusive lock to refresh the cache.
+
+    Yields False if blocking is False and another process holds the lock.
+    """
+    with open(LOCK_FILE, 'a') as fd:
+        flags = fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(fd, flags)
+            locked = True
+        except BlockingIOError:
+            locked = False
+        # closing the file releases the lock
+        yield locked
+
+
+def update_counters(increments, values):
+    """Update the cache counters, which are shared by all processes."""
+    try:
+        with open(COUNTERS_FILE, 'a+') as fd:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            fd.seek(0)
+            try:
+                counters = json.load(fd)
+            except ValueError:
+                counters = {}
+            for name, increment in increments.items():
+                counters[name] = counters.get(name, 0) + increment
+            counters.update(values)
+            fd.seek(0)
+            fd.truncate()
+            json.dump(counters, fd)
+            return counters
+    except OSError as e:
+        print('Cannot update counters:', e, file=sys.stderr)
         return {}
 
 
-def write_cache(lte_stats):
-    with open(CACHE_FILE, 'w') as fd:
-        json.dump(lte_stats, fd)
+def read_index():
+    try:
+        with open(INDEX_FILE) as fd:
+            return json.load(fd)
+    except (FileNotFoundError, ValueError):
+        return {}
 
 
-def lte_stats(api, interface='LTE1'):
-    json = {
-        'query': '{ allRouters { nodes { nodes { nodes { deviceInterfaces(name: "' + interface + '") { nodes { networkInterfaces { nodes { deviceInterface { state { networkPluginState } } } } } } } } } } }'
-    }
-    request = api.post('/graphql', json)
-    if request.status_code == 200:
-        return request.json()['data']['allRouters']['nodes'][0]['nodes']['nodes'][0]['deviceInterfaces']['nodes'][0]['networkInterfaces']['nodes'][0]['deviceInterface']['state']['networkPluginState']['LTE']
+def assign_index(modems):
+    """Assign a row index to every modem, which is kept across refreshes.
+
+    Indexes of modems which have been removed are not reused.
+    """
+    index = read_index()
+    changed = False
+    for modem in modems:
+        key = '{}/{}'.format(modem['node'], modem['interface'])
+        if key not in index:
+            index[key] = max(index.values(), default=0) + 1
+            changed = True
+        modem['index'] = index[key]
+    if changed:
+        try:
+            write_atomic(INDEX_FILE, json.dumps(index))
+        except OSError as e:
+            print('Cannot write index file:', e, file=sys.stderr)
+
+
+def get_plugin_state(device_interface):
+    try:
+        return device_interface['networkInterfaces']['nodes'][0]['deviceInterface']['state']['networkPluginState']['LTE']
+    except (IndexError, KeyError, TypeError):
+        return None
+
+
+def lte_stats(api):
+    """Return stats of the LTE interfaces of all nodes by a single query."""
+    request = api.post('/graphql', {'query': LTE_QUERY})
+    if request.status_code != 200:
+        error('Fetching LTE stats has failed.')
+    modems = []
+    for router in request.json()['data']['allRouters']['nodes']:
+        for node in router['nodes']['nodes']:
+            for device_interface in node['deviceInterfaces']['nodes']:
+                if device_interface.get('type') != INTERFACE_TYPE:
+                    continue
+                modems.append({
+                    'node': node['name'],
+                    'interface': device_interface['name'],
+                    'stats': get_plugin_state(device_interface) or {},
+                })
+    modems.sort(key=lambda modem: (modem['node'], modem['interface']))
+    assign_index(modems)
+    return modems
+
+
+def refresh_modems(api, increments, values):
+    """Fetch the LTE modems and write them to the cache."""
+    start = time.monotonic()
+    try:
+        modems = lte_stats(api or RestGraphqlApi())
+    except (Exception, SystemExit) as e:
+        print('Refreshing LTE stats has failed:', e, file=sys.stderr)
+        increments['refresh_failures'] = 1
+        return None
+    latency = int((time.monotonic() - start) * 1000)
+    write_cache(modems)
+    increments['refreshes'] = 1
+    increments['refresh_ms'] = latency
+    values['last_refresh_ms'] = latency
+    return modems
+
+
+def get_modems(api=None):
+    """Return the LTE modems from the cache and the cache counters.
+
+    Only one process refreshes an expired cache at a time. Meanwhile the
+    other processes are served the expired stats for up to CACHE_GRACE
+    seconds - or wait for the refresh if the cache is older.
+    """
+    increments = {}
+    values = {}
+    age, modems = read_cache()
+    if age is not None and age <= CACHE_TIMEOUT:
+        increments['hits'] = 1
     else:
-        error('Fetching LET stats has failed.')
+        stale = age is not None and age <= CACHE_TIMEOUT + CACHE_GRACE
+        with cache_lock(blocking=not stale) as locked:
+            if not locked:
+                increments['stale_hits'] = 1
+            else:
+                # the cache may have been refreshed while waiting
+                age, cached = read_cache()
+                if age is not None and age <= CACHE_TIMEOUT:
+                    increments['hits'] = 1
+                    modems = cached
+                else:
+                    increments['misses'] = 1
+                    refreshed = refresh_modems(api, increments, values)
+                    if refreshed is not None:
+                        modems = refreshed
+                    elif not stale:
+                        modems = None
+    return modems or [], update_counters(increments, values)
+
+
+def convert_value(stat, value):
+    """Return SNMP type and value of a stat."""
+    type = TYPES.get(stat, 'string')
+    if value.endswith(' dBm'):
+        type = 'integer'
+        value = value.strip(' dBm')
+    if value.endswith(' dB'):
+        type = 'integer'
+        value = value.strip(' dB')
+    return type, value
+
+
+def get_network_type(radio_interface):
+    try:
+        return NETWORK_TYPES.index(radio_interface)
+    except ValueError:
+        return -1
 
 
 def generate_object(index, key, value, type='string'):
@@ -170,43 +413,195 @@ def generate_object(index, key, value, type='string'):
     }
 
 
-def populate_objects():
-    stats = read_cache()
-    if not stats:
-        api = RestGraphqlApi()
-        stats = lte_stats(api)
-        write_cache(stats)
+def generate_table_objects(modem):
+    """Return the objects of a modem's row in the LTE table (100.2).
+
+    The table entry 100.2.1 has the columns index, node, interface,
+    network type and one column per stat: 100.2.1.{column}.{index}.
+    """
+    index = modem['index']
+    stats = modem['stats']
+    columns = [
+        ('integer', str(index)),
+        ('string', modem['node']),
+        ('string', modem['interface']),
+        ('integer', str(get_network_type(stats.get('Radio Interface')))),
+    ]
+    for stat in STATS:
+        if stat in stats:
+            columns.append(convert_value(stat, stats[stat]))
+        else:
+            columns.append(None)
+    objects = {}
+    for column, obj in enumerate(columns, start=1):
+        if obj:
+            objects['100.2.1.{}.{}'.format(column, index)] = list(obj)
+    return objects
+
+
+def generate_counter_objects(counters):
     objects = {}
+    for i, (name, type) in enumerate(COUNTERS, start=1):
+        value = counters.get(name, 0)
+        if type == 'counter':
+            # Counter32 wraps
+            value %= 2 ** 32
+        objects['100.3.{}'.format(i)] = [type, str(value)]
+    return objects
+
+
+def populate_objects(api=None):
+    modems, counters = get_modems(api)
+    modems = sorted(modems, key=lambda modem: modem['index'])
+    objects = {}
+    # 100.1 holds the stats of the first modem
+    stats = modems[0]['stats'] if modems else {}
     i = 1
     for stat in STATS:
         if stat in stats:
-            value = stats[stat]
-            type = TYPES.get(stat, 'string')
-            if value.endswith(' dBm'):
-                type = 'integer'
-                value = value.strip(' dBm')
-            if value.endswith(' dB'):
-                type = 'integer'
-                value = value.strip(' dB')
+            type, value = convert_value(stat, stats[stat])
             objects.update(generate_object(i, stat, value, type))
             if stat == 'Radio Interface':
                 i += 1
-                try:
-                    network_type = NETWORK_TYPES.index(value)
-                except ValueError:
-                    network_type = -1
-                objects.update(
-                    generate_object(i, 'Network Type', str(network_type), 'integer'))
+                objects.update(generate_object(
+                    i, 'Network Type', str(get_network_type(value)),
+                    'integer'))
         i += 1
+    for modem in modems:
+        objects.update(generate_table_objects(modem))
+    objects.update(generate_counter_objects(counters))
     return objects
 
 
+def oid_key(oid):
+    """Return an OID as tuple of numbers for numeric ordering.
+
+    Tuples compare like OIDs in a walk: 100.1.9.2 < 100.1.10.1 and
+    every OID sorts before the OIDs below it.
+    """
+    return tuple(int(part) for part in oid.strip('.').split('.') if part)
+
+
+class OidIndex(object):
+    """Objects sorted by OID, so GETNEXT is a binary search."""
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.keys = sorted(objects, key=lambda key: oid_key(BASE + key))
+        self.oids = [oid_key(BASE + key) for key in self.keys]
+
+    def get(self, oid):
+        if oid.startswith(BASE):
+            key = oid.split(BASE)[1]
+            obj = self.objects.get(key)
+            if obj:
+                return [oid] + obj
+        return None
+
+    def get_next(self, oid):
+        try:
+            requested = oid_key(oid)
+        except ValueError:
+            return None
+        i = bisect.bisect_right(self.oids, requested)
+        if i < len(self.keys):
+            key = self.keys[i]
+            return [BASE + key] + self.objects[key]
+        return None
+
+
+class ObjectTable(object):
+    """Objects of a long-lived process, refreshed in the background.
+
+    The table is empty until the first refresh has finished, so snmpd's
+    first PING is answered without waiting for the REST API.
+    """
+
+    def __init__(self, refresh_interval=CACHE_TIMEOUT):
+        self.lock = threading.Lock()
+        self.index = OidIndex({})
+        self.refresh_interval = refresh_interval
+        # set after the first refresh - successful or not
+        self.ready = threading.Event()
+        # reuse connection and token for all refreshes
+        self.api = RestGraphqlApi()
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+
+    def refresh(self):
+        try:
+            objects = populate_objects(self.api)
+        except (Exception, SystemExit) as e:
+            # keep serving the last objects
+            print('Refreshing LTE stats has failed:', e, file=sys.stderr)
+            return
+        index = OidIndex(objects)
+        with self.lock:
+            self.index = index
+
+    def run(self):
+        while True:
+            self.refresh()
+            self.ready.set()
+            time.sleep(self.refresh_interval)
+
+    def get(self, oid):
+        with self.lock:
+            index = self.index
+        return index.get(oid)
+
+    def get_next(self, oid):
+        with self.lock:
+            index = self.index
+        return index.get_next(oid)
+
+
+def reply(*lines):
+    print('\n'.join(lines), flush=True)
+
+
+def reply_object(obj):
+    if obj:
+        reply(*obj)
+    else:
+        reply('NONE')
+
+
+def pass_persist():
+    """Answer snmpd's pass_persist commands until stdin is closed."""
+    table = ObjectTable()
+    for command in sys.stdin:
+        command = command.strip()
+        if command == 'PING':
+            reply('PONG')
+        elif command == 'get':
+            reply_object(table.get(sys.stdin.readline().strip()))
+        elif command == 'getnext':
+            reply_object(table.get_next(sys.stdin.readline().strip()))
+        elif command == 'set':
+            # oid and "type value"
+            sys.stdin.readline()
+            sys.stdin.readline()
+            reply('not-writable')
+        elif not command:
+            break
+        else:
+            reply('NONE')
+
+
 if __name__ == '__main__':
     args = parse_arguments()
-    objects = populate_objects()
+    if args.persist:
+        pass_persist()
+        sys.exit(0)
+    if args.set:
+        print('not-writable')
+        sys.exit(0)
+    index = OidIndex(populate_objects())
+    obj = None
     if args.get:
-        if args.oid.startswith(BASE):
-            key = args.oid.split(BASE)[1]
-            obj = objects.get(key)
-            if obj:
-                 print('\n'.join([args.oid] + obj))
+        obj = index.get(args.oid)
+    elif args.next:
+        obj = index.get_next(args.oid)
+    if obj:
+        print('\n'.join(obj))
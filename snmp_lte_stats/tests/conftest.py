@@ -0,0 +1,70 @@
+"""Fixtures of the snmp_lte_stats tests."""
+import importlib.util
+import os
+
+import pytest
+
+SCRIPT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'snmp_lte_stats.py')
+
+
+def load_script():
+    spec = importlib.util.spec_from_file_location('snmp_lte_stats', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Response(object):
+
+    status_code = 200
+
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class Api(object):
+    """Answers the LTE query with two modems on two nodes."""
+
+    def __init__(self):
+        self.requests = 0
+
+    def post(self, location, json, authorization_required=True):
+        self.requests += 1
+        nodes = [{
+            'name': name,
+            'deviceInterfaces': {'nodes': [
+                {'name': 'ge-0-0', 'type': 'ethernet'},
+                {'name': 'LTE1', 'type': 'lte', 'networkInterfaces': {
+                    'nodes': [{'deviceInterface': {'state': {
+                        'networkPluginState': {'LTE': {
+                            'Radio Interface': 'lte',
+                            'RSSI Signal Strength': '-65 dBm',
+                            'SNR Signal Strength': '12 dB',
+                            'Carrier': carrier,
+                        }}}}}]}},
+            ]},
+        } for name, carrier in (('node1', 'Telekom'), ('node2', 'Vodafone'))]
+        return Response({'data': {'allRouters': {'nodes': [
+            {'nodes': {'nodes': nodes}}]}}})
+
+
+@pytest.fixture
+def script(tmp_path, monkeypatch):
+    """The script with files in tmp_path."""
+    module = load_script()
+    for name in ('CACHE_FILE', 'LOCK_FILE', 'COUNTERS_FILE', 'INDEX_FILE'):
+        monkeypatch.setattr(
+            module, name, str(tmp_path / name.lower().replace('_', '.')))
+    return module
+
+
+@pytest.fixture
+def snmp(script, monkeypatch):
+    """The script with files in tmp_path and a fake API."""
+    monkeypatch.setattr(script, 'RestGraphqlApi', Api)
+    return script
@@ -0,0 +1,57 @@
+"""Tests of the stale-while-revalidate cache."""
+import fcntl
+import os
+import time
+
+
+def expire_cache(snmp, age):
+    """Let the cache be age seconds older than CACHE_TIMEOUT."""
+    mtime = time.time() - snmp.CACHE_TIMEOUT - age
+    os.utime(snmp.CACHE_FILE, (mtime, mtime))
+
+
+def test_cache_is_shared(snmp):
+    api = snmp.RestGraphqlApi()
+    snmp.get_modems(api)
+    modems, counters = snmp.get_modems(api)
+    assert len(modems) == 2
+    assert api.requests == 1
+    assert counters['misses'] == 1
+    assert counters['hits'] == 1
+    assert counters['refreshes'] == 1
+
+
+def test_stale_cache_is_served_while_refreshing(snmp):
+    api = snmp.RestGraphqlApi()
+    snmp.get_modems(api)
+    expire_cache(snmp, 10)
+    # another process refreshes the cache
+    with open(snmp.LOCK_FILE, 'a') as fd:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        modems, counters = snmp.get_modems(api)
+    assert len(modems) == 2
+    assert api.requests == 1
+    assert counters['stale_hits'] == 1
+
+    modems, counters = snmp.get_modems(api)
+    assert api.requests == 2
+    assert counters['misses'] == 2
+
+
+def test_stale_cache_is_served_if_refresh_fails(snmp, monkeypatch):
+    api = snmp.RestGraphqlApi()
+    snmp.get_modems(api)
+    expire_cache(snmp, 10)
+
+    def fail(*args, **kwargs):
+        raise ConnectionError('conductor is not reachable')
+    monkeypatch.setattr(api, 'post', fail)
+    modems, counters = snmp.get_modems(api)
+    assert len(modems) == 2
+    assert counters['refresh_failures'] == 1
+
+    # ... but not after CACHE_GRACE
+    expire_cache(snmp, snmp.CACHE_GRACE + 10)
+    modems, counters = snmp.get_modems(api)
+    assert modems == []
+    assert counters['refresh_failures'] == 2
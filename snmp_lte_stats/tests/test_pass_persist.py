@@ -0,0 +1,71 @@
+"""Tests of the pass_persist protocol."""
+import threading
+
+
+class Stdin(object):
+    """Commands of snmpd - callables are called between them."""
+
+    def __init__(self, *lines):
+        self.lines = list(lines)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def readline(self):
+        while self.lines:
+            line = self.lines.pop(0)
+            if callable(line):
+                line()
+            else:
+                return line + '\n'
+        return ''
+
+
+def test_pass_persist(snmp, monkeypatch, capsys):
+    # the first refresh takes until it is released
+    released = threading.Event()
+
+    class SlowApi(snmp.RestGraphqlApi):
+
+        def post(self, *args, **kwargs):
+            released.wait(5)
+            return super().post(*args, **kwargs)
+
+    tables = []
+
+    class ObjectTable(snmp.ObjectTable):
+
+        def __init__(self):
+            super().__init__()
+            tables.append(self)
+
+    monkeypatch.setattr(snmp, 'RestGraphqlApi', SlowApi)
+    monkeypatch.setattr(snmp, 'ObjectTable', ObjectTable)
+    monkeypatch.setattr('sys.stdin', Stdin(
+        'PING',
+        'get', snmp.BASE + '100.1.1.2',
+        released.set,
+        lambda: tables[0].ready.wait(5),
+        'get', snmp.BASE + '100.1.1.2',
+        'getnext', snmp.BASE + '100.1.1.2',
+        'get', snmp.BASE + '100.9',
+        'set', snmp.BASE + '100.1.1.2', 'string foo',
+        'PING',
+    ))
+    snmp.pass_persist()
+    assert capsys.readouterr().out.splitlines() == [
+        # answered before the first refresh has finished
+        'PONG',
+        'NONE',
+        snmp.BASE + '100.1.1.2', 'string', 'lte',
+        snmp.BASE + '100.1.2.1', 'string', 'Network Type',
+        'NONE',
+        'not-writable',
+        'PONG',
+    ]
@@ -0,0 +1,14 @@
+"""Tests of the LTE table of all modems."""
+import os
+
+
+def test_rows_keep_their_index(snmp):
+    modems, _ = snmp.get_modems(snmp.RestGraphqlApi())
+    assert [modem['index'] for modem in modems] == [1, 2]
+    # a new modem sorts first but gets a new index
+    with open(snmp.INDEX_FILE, 'w') as fd:
+        fd.write('{"node2/LTE1": 1, "node9/LTE1": 2}')
+    os.unlink(snmp.CACHE_FILE)
+    modems, _ = snmp.get_modems(snmp.RestGraphqlApi())
+    assert {modem['node']: modem['index'] for modem in modems} == {
+        'node1': 3, 'node2': 1}
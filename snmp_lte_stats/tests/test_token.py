@@ -0,0 +1,122 @@
+"""Tests of the shared auth token and the retry of rejected requests."""
+import base64
+import json
+import threading
+import time
+
+import requests
+
+
+def create_token(expiry):
+    """Return a JWT which expires at unix time expiry."""
+    payload = base64.urlsafe_b64encode(
+        json.dumps({'exp': int(expiry)}).encode()).decode().rstrip('=')
+    return 'header.{}.signature'.format(payload)
+
+
+class Conductor(requests.adapters.BaseAdapter):
+    """Answers requests of a session with tokens of its logins."""
+
+    def __init__(self, token='token-1'):
+        super().__init__()
+        self.token = token
+        self.logins = 0
+        self.requests = []
+        # reject all tokens
+        self.reject = False
+
+    def send(self, request, **kwargs):
+        path = request.path_url
+        authorization = request.headers.get('Authorization')
+        self.requests.append((path, authorization))
+        if path == '/api/v1/login':
+            self.logins += 1
+            self.token = 'token-{}'.format(self.logins + 1)
+            return self.respond(request, 200, {'token': self.token})
+        if self.reject or authorization != 'Bearer ' + self.token:
+            return self.respond(request, 401, {'message': 'Unauthorized'})
+        return self.respond(request, 200, {'data': {}})
+
+    def respond(self, request, status_code, data):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = json.dumps(data).encode()
+        response.headers['Content-Type'] = 'application/json'
+        response.request = request
+        response.url = request.url
+        return response
+
+    def close(self):
+        pass
+
+
+def test_token_expiry(script):
+    expiry = time.time() + 3600
+    assert script.get_token_expiry(create_token(expiry)) == int(expiry)
+    assert script.get_token_expiry('no-jwt') is None
+    assert not script.token_expires_soon(create_token(expiry))
+    assert script.token_expires_soon(create_token(time.time() + 60))
+    # tokens without expiry are used until they are rejected
+    assert not script.token_expires_soon('no-jwt')
+
+
+def test_only_one_thread_logs_in(script, tmp_path):
+    logins = []
+
+    def login():
+        logins.append(1)
+        time.sleep(0.1)
+        return create_token(time.time() + 3600)
+
+    token_file = str(tmp_path / 'token')
+    tokens = script.TokenManager(token_file, login)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(tokens.get()))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(logins) == 1
+    assert len(set(results)) == 1
+
+    # another process uses the token of the last login
+    other = script.TokenManager(token_file, login)
+    assert other.get() == results[0]
+    assert len(logins) == 1
+
+
+def test_token_is_refreshed_before_it_expires(script, tmp_path):
+    token_file = str(tmp_path / 'token')
+    with open(token_file, 'w') as fd:
+        fd.write(create_token(time.time() + 60))
+    tokens = script.TokenManager(token_file, lambda: 'new')
+    assert tokens.get() == 'new'
+    with open(token_file) as fd:
+        assert fd.read() == 'new'
+
+
+def test_rejected_request_is_retried_once(script, tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    api = script.RestGraphqlApi(password='secret')
+    conductor = Conductor()
+    api.session.mount('https://', conductor)
+    response = api.post('/graphql', {'query': '{}'})
+    assert response.status_code == 200
+    assert conductor.logins == 1
+
+    # the token has been revoked
+    conductor.token = 'revoked'
+    response = api.post('/graphql', {'query': '{}'})
+    assert response.status_code == 200
+    assert conductor.logins == 2
+    assert [path for path, _ in conductor.requests] == [
+        '/api/v1/login', '/api/v1/graphql',
+        '/api/v1/graphql', '/api/v1/login', '/api/v1/graphql',
+    ]
+
+    # a request which is rejected again is not retried twice
+    conductor.reject = True
+    response = api.post('/graphql', {'query': '{}'})
+    assert response.status_code == 401
+    assert conductor.logins == 3
@@ -0,0 +1,53 @@
+"""Tests of GET/GETNEXT requests and walks."""
+import os
+import subprocess
+import sys
+
+import pytest
+
+SCRIPT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'snmp_lte_stats.py')
+BASE = '.1.3.6.1.4.1.45956.1.'
+
+
+def test_get(snmp):
+    index = snmp.OidIndex(snmp.populate_objects())
+    assert index.get(BASE + '100.1.1.2') == [
+        BASE + '100.1.1.2', 'string', 'lte']
+    assert index.get(BASE + '100.1.2.2') == [
+        BASE + '100.1.2.2', 'integer', '3']
+    # table rows of both modems
+    assert index.get(BASE + '100.2.1.2.1')[2] == 'node1'
+    assert index.get(BASE + '100.2.1.2.2')[2] == 'node2'
+    assert index.get(BASE + '100.2.1.6.1')[1:] == ['integer', '-65']
+    assert index.get(BASE + '100.2.1.10.2')[1:] == ['string', 'Vodafone']
+    assert index.get(BASE + '100.9') is None
+    assert index.get('.1.3.6.1.2.1.1.1.0') is None
+
+
+def test_get_next_walks_all_objects(snmp):
+    objects = snmp.populate_objects()
+    index = snmp.OidIndex(objects)
+    oid = BASE.rstrip('.')
+    walked = []
+    while True:
+        obj = index.get_next(oid)
+        if obj is None:
+            break
+        oid = obj[0]
+        walked.append(oid)
+    assert len(walked) == len(objects)
+    # OIDs are walked in numeric, not lexical order
+    keys = [snmp.oid_key(oid) for oid in walked]
+    assert keys == sorted(keys)
+    assert index.get_next(BASE + '100.1.1.1')[0] == BASE + '100.1.1.2'
+    assert index.get_next(BASE + '100.3.7') is None
+
+
+@pytest.mark.parametrize('option', ['-g', '-n'])
+def test_oid_is_required(option):
+    process = subprocess.run(
+        [sys.executable, SCRIPT, option], capture_output=True, text=True)
+    assert process.returncode == 2
+    assert 'the OID is required' in process.stderr